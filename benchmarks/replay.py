@@ -0,0 +1,288 @@
+"""Replays presence updates into the Status cog without a Discord connection
+
+Builds lightweight stand-ins for the guilds and members the cog looks at,
+then feeds a synthetic or recorded presence trace into its listeners at a
+configurable rate, against a local database. `~stats` invocations can be
+mixed in. Reports event throughput, handler latency percentiles and event
+loop lag.
+
+    python -m benchmarks.replay [--database-uri URI] [--events N] [--rate N]
+                                [--stats-rate N] [--trace FILE]
+
+Traces are JSON lines with `guild_id`, `user_id` and `status` (the status
+the member changes to). Use --write-trace to save a synthetic trace so
+that a run can be repeated exactly.
+"""
+import argparse
+import asyncio
+import collections
+import json
+import random
+import statistics
+import time
+from dataclasses import dataclass, field, replace
+from typing import Iterator, Optional
+
+import discord
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from observer import config
+from observer.bot import cogs
+from observer.data.models import metadata
+from observer.data.repository import StatusLogRepository
+
+
+STATUSES = [
+    discord.Status.online,
+    discord.Status.idle,
+    discord.Status.dnd,
+    discord.Status.offline,
+]
+
+
+@dataclass(eq=False)
+class FakeGuild:
+    id: int
+    members_by_id: dict[int, "FakeMember"] = field(default_factory=dict)
+
+    @property
+    def members(self) -> list["FakeMember"]:
+        return list(self.members_by_id.values())
+
+
+@dataclass(eq=False)
+class FakeMember:
+    id: int
+    guild: FakeGuild
+    status: discord.Status
+
+
+class FakeBot:
+    def __init__(self, guilds: list[FakeGuild]) -> None:
+        self.guilds = {guild.id: guild for guild in guilds}
+
+    def get_guild(self, guild_id: int) -> Optional[FakeGuild]:
+        return self.guilds.get(guild_id)
+
+    async def fetch_guild(self, guild_id: int) -> FakeGuild:
+        return self.guilds[guild_id]
+
+
+class FakeContext:
+    def __init__(self, guild: FakeGuild, author: FakeMember) -> None:
+        self.guild = guild
+        self.author = author
+        self.sent = []
+
+    async def send(self, content=None, file=None):
+        self.sent.append(content or file)
+
+
+def synthetic_trace(
+    guild_ids: list[int], members: int, events: int, seed: int
+) -> Iterator[dict]:
+    rng = random.Random(seed)
+    statuses = {}
+
+    for _ in range(events):
+        guild_id = rng.choice(guild_ids)
+        user_id = rng.randrange(members)
+        current = statuses.get((guild_id, user_id), "offline")
+        status = rng.choice([s.name for s in STATUSES if s.name != current])
+        statuses[guild_id, user_id] = status
+
+        yield {"guild_id": guild_id, "user_id": user_id, "status": status}
+
+
+def read_trace(path: str) -> Iterator[dict]:
+    with open(path) as fp:
+        for line in fp:
+            if line.strip():
+                yield json.loads(line)
+
+
+def percentiles(values: list[float]) -> str:
+    if len(values) < 2:
+        return "not enough samples"
+
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return "p50 {:.2f}ms  p90 {:.2f}ms  p99 {:.2f}ms  max {:.2f}ms".format(
+        cuts[49] * 1000, cuts[89] * 1000, cuts[98] * 1000, max(values) * 1000
+    )
+
+
+async def measure_loop_lag(lags: list[float], interval: float = 0.01) -> None:
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - started - interval)
+
+
+async def replay(args: argparse.Namespace) -> None:
+    engine = create_async_engine(args.database_uri)
+
+    async with engine.begin() as conn:
+        if args.reset:
+            await conn.run_sync(metadata.drop_all)
+        await conn.run_sync(metadata.create_all)
+
+    if args.trace:
+        trace = list(read_trace(args.trace))
+    else:
+        trace = list(
+            synthetic_trace(
+                list(range(1, args.guilds + 1)), args.members, args.events, args.seed
+            )
+        )
+
+    if args.write_trace:
+        with open(args.write_trace, "w") as fp:
+            fp.writelines(json.dumps(event) + "\n" for event in trace)
+
+    # Every member referenced by the trace starts out offline
+    guilds = {}
+    for event in trace:
+        guild = guilds.setdefault(event["guild_id"], FakeGuild(event["guild_id"]))
+        guild.members_by_id.setdefault(
+            event["user_id"],
+            FakeMember(event["user_id"], guild, discord.Status.offline),
+        )
+
+    repo = StatusLogRepository(engine)
+    cog = cogs.Status(
+        bot=FakeBot(list(guilds.values())), repo=repo, guild_ids=list(guilds)
+    )
+
+    lags = []
+    lag_monitor = asyncio.create_task(measure_loop_lag(lags))
+
+    try:
+        started = time.perf_counter()
+        await cog.on_ready()
+        print(f"on_ready: {(time.perf_counter() - started) * 1000:.1f}ms")
+
+        # Latencies of the successful calls and number of failed ones, by
+        # kind of call
+        latencies = {"presence": [], "stats": []}
+        errors = collections.Counter()
+        error_messages = collections.Counter()
+        pending = set()
+
+        async def dispatch(coro, kind: str) -> None:
+            dispatched = time.perf_counter()
+            try:
+                await coro
+            except Exception as error:
+                errors[kind] += 1
+                message = str(error).splitlines()[0] if str(error) else ""
+                error_messages[f"{type(error).__name__}: {message}"] += 1
+            else:
+                latencies[kind].append(time.perf_counter() - dispatched)
+
+        def spawn(coro, kind: str) -> None:
+            # Listeners are run as separate tasks, like discord.py does
+            task = asyncio.create_task(dispatch(coro, kind))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+
+        stats_every = (
+            max(round(args.rate / args.stats_rate), 1) if args.stats_rate else None
+        )
+        rng = random.Random(args.seed)
+        started = time.perf_counter()
+
+        for index, event in enumerate(trace):
+            if args.rate:
+                delay = started + index / args.rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    # Still give the handlers a chance to run when behind
+                    await asyncio.sleep(0)
+
+            guild = guilds[event["guild_id"]]
+            before = guild.members_by_id[event["user_id"]]
+            after = replace(before, status=discord.Status(event["status"]))
+            guild.members_by_id[after.id] = after
+
+            spawn(cog.on_presence_update(before, after), "presence")
+
+            if stats_every and index % stats_every == 0:
+                ctx = FakeContext(guild, rng.choice(guild.members))
+                spawn(cog.stats.callback(cog, ctx, None), "stats")
+
+        if pending:
+            await asyncio.wait(pending)
+
+        elapsed = time.perf_counter() - started
+
+        print(f"events:           {len(trace)} in {elapsed:.2f}s")
+        print(
+            f"errors:           {errors['presence']} events"
+            f" ({errors['presence'] / len(trace) * 100:.1f}%),"
+            f" {errors['stats']} ~stats calls"
+        )
+        for message, count in error_messages.most_common(5):
+            print(f"                  {count:>6}x {message}")
+        # Only the events that made it to the database count
+        throughput = len(latencies["presence"]) / elapsed
+        print(f"throughput:       {throughput:.1f} events/s")
+        print(f"presence handler: {percentiles(latencies['presence'])}")
+        if latencies["stats"] or errors["stats"]:
+            print(
+                f"~stats:           {percentiles(latencies['stats'])}"
+                f" ({len(latencies['stats'])} calls)"
+            )
+            for guild_id, metrics in cog.stats_metrics.items():
+                print(f"~stats queue:     guild {guild_id}: {metrics}")
+        print(f"event loop lag:   {percentiles(lags)}")
+
+    finally:
+        lag_monitor.cancel()
+        await cog.cog_unload()
+        await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--database-uri",
+        default=config.TEST_DATABASE_URI,
+        help="defaults to TEST_DATABASE_URI",
+    )
+    parser.add_argument(
+        "--reset",
+        action="store_true",
+        help="drop and re-create all the tables first",
+    )
+    parser.add_argument("--trace", help="replay a recorded trace instead")
+    parser.add_argument("--write-trace", help="save the replayed trace to a file")
+    parser.add_argument("--guilds", type=int, default=2)
+    parser.add_argument("--members", type=int, default=1000, help="per guild")
+    parser.add_argument("--events", type=int, default=10000)
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=0,
+        help="presence updates per second; 0 replays as fast as possible",
+    )
+    parser.add_argument(
+        "--stats-rate",
+        type=float,
+        default=0,
+        help="~stats invocations per second of replayed time (requires --rate)",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if not args.database_uri:
+        parser.error("--database-uri or TEST_DATABASE_URI is required")
+
+    if args.stats_rate and not args.rate:
+        parser.error("--stats-rate requires --rate")
+
+    asyncio.run(replay(args))
+
+
+if __name__ == "__main__":
+    main()
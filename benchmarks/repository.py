@@ -0,0 +1,150 @@
+"""Measures the per-call overhead of the hot repository paths
+
+Compares, for `log_status_change` and `get_user_stats`, the statements
+being built on every call (as the repository used to do) with the
+prebuilt ones, and for the insert also the raw asyncpg fast path. Reports
+the process CPU time and the wall time per call; at high event rates the
+CPU time is what the bot's event loop is busy for.
+
+    python -m benchmarks.repository [--database-uri URI] [--calls N]
+"""
+import argparse
+import asyncio
+import datetime
+import time
+from typing import Awaitable, Callable
+
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from observer import config
+from observer.data import repository
+from observer.data.models import StatusLog, metadata
+from observer.data.repository import StatusLogRepository
+
+
+STATUSES = ["online", "idle", "dnd", "offline"]
+
+
+async def legacy_log_status_change(
+    engine: AsyncEngine, user_id, guild_id, before, after, timestamp
+) -> None:
+    async with engine.begin() as conn:
+        await conn.execute(
+            StatusLog.insert(),
+            {
+                "user_id": user_id,
+                "guild_id": guild_id,
+                "before": before,
+                "after": after,
+                "time": timestamp,
+            },
+        )
+
+
+async def legacy_get_user_stats(engine: AsyncEngine, user_id, guild_id):
+    async with engine.connect() as conn:
+        result = await conn.execute(
+            repository._user_stats_query(), {"user_id": user_id, "guild_id": guild_id}
+        )
+        return result.fetchall()
+
+
+async def timed(
+    label: str, calls: int, func: Callable[[int], Awaitable[object]]
+) -> None:
+    # Warm up the pool, the statement caches and the prepared statements
+    for index in range(min(calls, 100)):
+        await func(index)
+
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    for index in range(calls):
+        await func(index)
+    cpu = time.process_time() - cpu_started
+    wall = time.perf_counter() - started
+
+    print(
+        f"{label:<32} {cpu / calls * 1e6:>8.1f}us CPU"
+        f" {wall / calls * 1e6:>8.1f}us wall"
+        f" {calls / cpu:>9.0f} calls/CPU-s"
+    )
+
+
+async def bench(args: argparse.Namespace) -> None:
+    engine = create_async_engine(args.database_uri)
+
+    async with engine.begin() as conn:
+        await conn.run_sync(metadata.drop_all)
+        await conn.run_sync(metadata.create_all)
+
+    core = StatusLogRepository(engine, use_raw_inserts=False)
+    raw = StatusLogRepository(engine)
+    if not raw.use_raw_inserts:
+        print("the raw asyncpg path needs a postgresql+asyncpg URI")
+
+    started = datetime.datetime(2023, 1, 1)
+
+    def change(index: int) -> tuple:
+        # A handful of users changing status every second
+        return (
+            index % args.users,
+            1,
+            STATUSES[index % 4],
+            STATUSES[(index + 1) % 4],
+            started + datetime.timedelta(seconds=index),
+        )
+
+    try:
+        print(f"log_status_change ({args.calls} calls)")
+        await timed(
+            "  built per call",
+            args.calls,
+            lambda index: legacy_log_status_change(engine, *change(index)),
+        )
+        await timed(
+            "  prebuilt",
+            args.calls,
+            lambda index: core.log_status_change(*change(index)),
+        )
+        if raw.use_raw_inserts:
+            await timed(
+                "  raw asyncpg",
+                args.calls,
+                lambda index: raw.log_status_change(*change(index)),
+            )
+
+        print(f"get_user_stats ({args.calls} calls)")
+        await timed(
+            "  built per call",
+            args.calls,
+            lambda index: legacy_get_user_stats(engine, index % args.users, 1),
+        )
+        await timed(
+            "  prebuilt",
+            args.calls,
+            lambda index: core.get_user_stats(index % args.users, 1),
+        )
+
+    finally:
+        await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--database-uri",
+        default=config.TEST_DATABASE_URI,
+        help="defaults to TEST_DATABASE_URI; the tables are re-created",
+    )
+    parser.add_argument("--calls", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=50)
+    args = parser.parse_args()
+
+    if not args.database_uri:
+        parser.error("--database-uri or TEST_DATABASE_URI is required")
+
+    asyncio.run(bench(args))
+
+
+if __name__ == "__main__":
+    main()
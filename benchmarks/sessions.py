@@ -0,0 +1,162 @@
+"""Measures `get_user_sessions` on large histories
+
+Fills StatusLog with a long synthetic history for a single user, then
+compares streaming the intervals into histograms, as the repository does,
+with fetching them all and computing exact percentiles in Python. Reports
+the time and the peak Python memory of both, and how far the histogram
+percentiles are from the exact ones.
+
+    python -m benchmarks.sessions [--database-uri URI] [--rows N]
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import tracemalloc
+
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from observer import config
+from observer.data import repository
+from observer.data.models import metadata
+from observer.data.repository import StatusLogRepository
+from observer.data.sessions import SessionStats
+
+
+USER_ID = 1
+GUILD_ID = 1
+
+# A change every 1s to 2h, with a restart of the bot every 1000 changes
+GENERATE = """
+    INSERT INTO "StatusLog" (user_id, guild_id, before, after, time)
+    SELECT
+        :user_id,
+        :guild_id,
+        CASE WHEN i % 1000 = 0 THEN NULL ELSE lag(status) OVER w END,
+        status,
+        timestamp '2020-01-01' + sum(gap) OVER w
+    FROM (
+        SELECT
+            i,
+            (ARRAY['online', 'offline', 'idle', 'dnd'])[1 + floor(random() * 4)::int]
+                ::status AS status,
+            (1 + floor(random() * random() * 7200)) * interval '1 second' AS gap
+        FROM generate_series(1, :rows) AS i
+    ) AS changes
+    WINDOW w AS (ORDER BY i)
+"""
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+async def fetch_all(engine: AsyncEngine) -> dict:
+    """Session lengths per status, from all the intervals at once"""
+    async with engine.connect() as conn:
+        result = await conn.execute(
+            repository.USER_INTERVALS_QUERY,
+            {"user_id": USER_ID, "guild_id": GUILD_ID},
+        )
+        rows = result.fetchall()
+
+    lengths = {}
+    status = end = None
+    for row in rows:
+        if row.end_time <= row.start_time:
+            continue
+
+        if row.status == status and row.start_time == end:
+            lengths[status][-1] += (row.end_time - end).total_seconds()
+        else:
+            lengths.setdefault(row.status, []).append(
+                (row.end_time - row.start_time).total_seconds()
+            )
+
+        status, end = row.status, row.end_time
+
+    return {
+        status: statistics.quantiles(values, n=100, method="inclusive")
+        for status, values in lengths.items()
+        if len(values) > 1
+    }
+
+
+async def measure(label: str, func) -> object:
+    started = time.perf_counter()
+    result = await func()
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    await func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{label:<10} {elapsed:>8.2f}s {peak / 2**20:>10.1f}MB peak")
+    return result
+
+
+async def bench(args: argparse.Namespace) -> None:
+    engine = create_async_engine(args.database_uri)
+
+    try:
+        async with engine.begin() as conn:
+            await conn.run_sync(metadata.drop_all)
+            await conn.run_sync(metadata.create_all)
+
+            started = time.perf_counter()
+            await conn.execute(sa.text("SELECT setseed(0.5)"))
+            await conn.execute(
+                sa.text(GENERATE),
+                {"user_id": USER_ID, "guild_id": GUILD_ID, "rows": args.rows},
+            )
+            print(f"generated {args.rows} rows in {time.perf_counter() - started:.1f}s")
+
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            await conn.execute(sa.text('VACUUM ANALYZE "StatusLog"'))
+
+        repo = StatusLogRepository(engine)
+
+        stats: SessionStats = await measure(
+            "streamed", lambda: repo.get_user_sessions(USER_ID, GUILD_ID)
+        )
+        exact = await measure("fetchall", lambda: fetch_all(engine))
+
+        print()
+        print(
+            f"{'status':<8} {'sessions':>9}"
+            + "".join(f" {'p' + format(q * 100, 'g'):>18}" for q in QUANTILES)
+        )
+        for status, histogram in stats.histograms.items():
+            cells = []
+            for q in QUANTILES:
+                estimate = histogram.quantile(q)
+                actual = exact[status][round(q * 100) - 1]
+                cells.append(
+                    f" {estimate:>9.0f}s {(estimate / actual - 1) * 100:>+6.2f}%"
+                )
+
+            print(f"{status.name:<8} {histogram.count:>9}" + "".join(cells))
+
+    finally:
+        await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--database-uri",
+        default=config.TEST_DATABASE_URI,
+        help="defaults to TEST_DATABASE_URI; the tables are re-created",
+    )
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    if not args.database_uri:
+        parser.error("--database-uri or TEST_DATABASE_URI is required")
+
+    asyncio.run(bench(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""Measures how long the bot takes to start
+
+Imports `observer.__main__` under `python -X importtime` a few times and
+reports where the import time goes. With --live, also starts the bot for
+real (using the configuration from the environment) and reports the time
+to `on_ready` and to the first logged presence update.
+
+    python -m benchmarks.startup [--runs N] [--live] [--timeout SECONDS]
+"""
+import argparse
+import collections
+import queue
+import signal
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+
+READY_MESSAGE = "Logged initial statuses"
+FIRST_PRESENCE_MESSAGE = "Logged first presence update"
+
+
+def parse_importtime(lines: list[str]) -> dict[str, tuple[int, int]]:
+    """Returns the (self, cumulative) import time in microseconds per module"""
+    times = {}
+    for line in lines:
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+
+    return times
+
+
+def bench_imports(runs: int) -> None:
+    totals = []
+    by_package = collections.Counter()
+
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import observer.__main__"],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+
+        times = parse_importtime(result.stderr.splitlines())
+        totals.append(times["observer.__main__"][1])
+
+        for name, (self_us, _) in times.items():
+            by_package[name.split(".")[0]] += self_us
+
+    print(f"import observer.__main__: {statistics.median(totals) / 1000:.1f}ms")
+    print("slowest packages (mean self time):")
+    for package, total_us in by_package.most_common(10):
+        print(f"  {package:<24} {total_us / runs / 1000:8.1f}ms")
+
+
+def _read_lines(stream, lines: queue.Queue) -> None:
+    for line in stream:
+        lines.put((time.perf_counter(), line))
+
+    lines.put((time.perf_counter(), None))
+
+
+def bench_live(timeout: float) -> None:
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-X", "importtime", "-m", "observer"],
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+
+    lines = queue.Queue()
+    threading.Thread(
+        target=_read_lines, args=(process.stderr, lines), daemon=True
+    ).start()
+
+    import_lines = []
+    marks = {}
+
+    try:
+        while FIRST_PRESENCE_MESSAGE not in marks:
+            remaining = started + timeout - time.perf_counter()
+            if remaining <= 0:
+                break
+
+            try:
+                timestamp, line = lines.get(timeout=remaining)
+            except queue.Empty:
+                break
+
+            if line is None:
+                print("bot exited before startup completed")
+                break
+
+            if line.startswith("import time:"):
+                import_lines.append(line)
+                continue
+
+            for message in (READY_MESSAGE, FIRST_PRESENCE_MESSAGE):
+                if message in line and message not in marks:
+                    marks[message] = timestamp - started
+
+    finally:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    times = parse_importtime(import_lines)
+    imports_us = sum(self_us for self_us, _ in times.values())
+
+    print(f"imports:              {imports_us / 1000:.1f}ms")
+    for label, message in (
+        ("on_ready:", READY_MESSAGE),
+        ("first presence:", FIRST_PRESENCE_MESSAGE),
+    ):
+        if message in marks:
+            print(f"{label:<21} {marks[message] * 1000:.1f}ms")
+        else:
+            print(f"{label:<21} not reached within {timeout}s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument(
+        "--live",
+        action="store_true",
+        help="also start the bot and time on_ready and the first presence update",
+    )
+    parser.add_argument("--timeout", type=float, default=120.0)
+    args = parser.parse_args()
+
+    bench_imports(args.runs)
+
+    if args.live:
+        print()
+        bench_live(args.timeout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""Compares the on-disk size and scan speed of StatusLog row layouts
+
+Fills scratch tables with the same synthetic history in each layout:
+
+- current:  the StatusLog layout, two ENUMs for the before/after statuses
+- status:   one SMALLINT status code per row, columns ordered widest first
+- interval: closed intervals with an int32 duration in seconds
+
+then reports the table and index sizes, the average row size, and the time
+taken by a whole-table stats aggregation and by per-user stats queries.
+Only meant to be run against a scratch PostgreSQL database.
+
+    python -m benchmarks.storage --database-uri URI [--rows N] [--keep]
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import AsyncConnection, create_async_engine
+
+
+# Synthetic history: every user flips between random statuses, spread over
+# a few guilds, one change every few minutes.
+SETUP = [
+    "DROP TABLE IF EXISTS bench_current, bench_status, bench_interval",
+    "DROP TYPE IF EXISTS bench_status_enum",
+    "CREATE TYPE bench_status_enum AS ENUM ('online', 'offline', 'idle', 'dnd')",
+    "SELECT setseed(0.5)",
+    """
+    CREATE TABLE bench_current AS
+    SELECT
+        user_id,
+        guild_id,
+        lag(status) OVER w AS before,
+        status AS after,
+        time
+    FROM (
+        SELECT
+            (i % :users)::bigint AS user_id,
+            (1 + i % :guilds)::bigint AS guild_id,
+            (ARRAY['online', 'offline', 'idle', 'dnd'])[1 + floor(random() * 4)::int]
+                ::bench_status_enum AS status,
+            timestamp '2023-01-01' + i * interval '1 second' * :spacing AS time
+        FROM generate_series(1, :rows) AS i
+    ) AS changes
+    WINDOW w AS (PARTITION BY user_id, guild_id ORDER BY time)
+    """,
+    """
+    CREATE TABLE bench_status AS
+    SELECT time, user_id, guild_id, (array_position(
+        enum_range(NULL::bench_status_enum), after
+    ))::smallint AS status
+    FROM bench_current
+    """,
+    """
+    CREATE TABLE bench_interval AS
+    SELECT start_time, user_id, guild_id, duration, status
+    FROM (
+        SELECT
+            time AS start_time,
+            user_id,
+            guild_id,
+            extract(epoch FROM lead(time) OVER w - time)::integer AS duration,
+            status
+        FROM bench_status
+        WINDOW w AS (PARTITION BY user_id, guild_id ORDER BY time)
+    ) AS intervals
+    WHERE duration IS NOT NULL
+    """,
+    "CREATE INDEX ON bench_current (guild_id, user_id, time)",
+    "CREATE INDEX ON bench_status (guild_id, user_id, time)",
+    "CREATE INDEX ON bench_interval (guild_id, user_id, start_time)",
+    "VACUUM ANALYZE bench_current",
+    "VACUUM ANALYZE bench_status",
+    "VACUUM ANALYZE bench_interval",
+]
+
+TEARDOWN = [
+    "DROP TABLE IF EXISTS bench_current, bench_status, bench_interval",
+    "DROP TYPE IF EXISTS bench_status_enum",
+]
+
+# Total time per (guild, user, status), as the StatusStats view computes it
+AGGREGATE = {
+    "current": """
+        SELECT guild_id, user_id, before, sum(end_time - start_time)
+        FROM (
+            SELECT guild_id, user_id, before, time AS end_time,
+                lag(time) OVER w AS start_time,
+                lag(after) OVER w = before AS is_valid
+            FROM bench_current
+            WINDOW w AS (PARTITION BY guild_id, user_id ORDER BY time)
+        ) AS intervals
+        WHERE is_valid
+        GROUP BY 1, 2, 3
+    """,
+    "status": """
+        SELECT guild_id, user_id, status, sum(end_time - start_time)
+        FROM (
+            SELECT guild_id, user_id, status, time AS start_time,
+                lead(time) OVER w AS end_time
+            FROM bench_status
+            WINDOW w AS (PARTITION BY guild_id, user_id ORDER BY time)
+        ) AS intervals
+        WHERE end_time IS NOT NULL
+        GROUP BY 1, 2, 3
+    """,
+    "interval": """
+        SELECT guild_id, user_id, status, sum(duration)
+        FROM bench_interval
+        GROUP BY 1, 2, 3
+    """,
+}
+
+# The same for a single user, as get_user_stats does
+USER_STATS = {
+    "current": """
+        SELECT before, sum(end_time - start_time)
+        FROM (
+            SELECT before, time AS end_time,
+                lag(time) OVER (ORDER BY time) AS start_time,
+                lag(after) OVER (ORDER BY time) = before AS is_valid
+            FROM bench_current
+            WHERE guild_id = :guild_id AND user_id = :user_id
+        ) AS intervals
+        WHERE is_valid
+        GROUP BY 1
+    """,
+    "status": """
+        SELECT status, sum(end_time - start_time)
+        FROM (
+            SELECT status, time AS start_time,
+                lead(time) OVER (ORDER BY time) AS end_time
+            FROM bench_status
+            WHERE guild_id = :guild_id AND user_id = :user_id
+        ) AS intervals
+        WHERE end_time IS NOT NULL
+        GROUP BY 1
+    """,
+    "interval": """
+        SELECT status, sum(duration)
+        FROM bench_interval
+        WHERE guild_id = :guild_id AND user_id = :user_id
+        GROUP BY 1
+    """,
+}
+
+
+async def timed(conn: AsyncConnection, query: str, **params) -> float:
+    started = time.perf_counter()
+    await conn.execute(sa.text(f"SELECT count(*) FROM ({query}) AS q"), params)
+    return time.perf_counter() - started
+
+
+async def bench(args: argparse.Namespace) -> None:
+    engine = create_async_engine(args.database_uri)
+    users = max(args.rows // args.changes_per_user, 1)
+
+    try:
+        async with engine.begin() as conn:
+            started = time.perf_counter()
+            for statement in SETUP:
+                if statement.startswith("VACUUM"):
+                    continue
+                await conn.execute(
+                    sa.text(statement),
+                    {
+                        "rows": args.rows,
+                        "users": users,
+                        "guilds": args.guilds,
+                        "spacing": 180,
+                    },
+                )
+            print(f"generated {args.rows} rows in {time.perf_counter() - started:.1f}s")
+
+        # VACUUM cannot run inside a transaction
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            for statement in SETUP:
+                if statement.startswith("VACUUM"):
+                    await conn.execute(sa.text(statement))
+
+        async with engine.connect() as conn:
+            print(
+                f"{'layout':<10} {'rows':>10} {'heap':>10} {'index':>10}"
+                f" {'row size':>9} {'aggregate':>10} {'user p50':>9}"
+            )
+
+            for layout in ("current", "status", "interval"):
+                table = f"bench_{layout}"
+                rows, heap, index, row_size = (
+                    await conn.execute(
+                        sa.text(
+                            f"""
+                            SELECT
+                                (SELECT count(*) FROM {table}),
+                                pg_table_size('{table}'),
+                                pg_indexes_size('{table}'),
+                                (SELECT avg(pg_column_size(t.*))
+                                 FROM (SELECT * FROM {table} LIMIT 10000) AS t)
+                            """
+                        )
+                    )
+                ).one()
+
+                aggregate = min(
+                    [await timed(conn, AGGREGATE[layout]) for _ in range(args.runs)]
+                )
+                user_times = [
+                    await timed(
+                        conn,
+                        USER_STATS[layout],
+                        guild_id=1 + user_id % args.guilds,
+                        user_id=user_id,
+                    )
+                    for user_id in range(0, users, max(users // 200, 1))
+                ]
+
+                print(
+                    f"{layout:<10} {rows:>10} {heap / 2**20:>8.1f}MB"
+                    f" {index / 2**20:>8.1f}MB {float(row_size):>8.1f}B"
+                    f" {aggregate:>9.2f}s"
+                    f" {statistics.median(user_times) * 1000:>7.2f}ms"
+                )
+
+    finally:
+        if not args.keep:
+            async with engine.begin() as conn:
+                for statement in TEARDOWN:
+                    await conn.execute(sa.text(statement))
+
+        await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-uri", required=True)
+    parser.add_argument("--rows", type=int, default=50_000_000)
+    parser.add_argument("--guilds", type=int, default=3)
+    parser.add_argument("--changes-per-user", type=int, default=1000)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument(
+        "--keep", action="store_true", help="keep the scratch tables afterwards"
+    )
+    args = parser.parse_args()
+
+    asyncio.run(bench(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Create GuildActivity
+
+Revision ID: 3f1c2b7d9e4a
+Revises: 7dcf2a45bb0b
+Create Date: 2026-10-19 10:12:41.205318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "3f1c2b7d9e4a"
+down_revision = "7dcf2a45bb0b"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "GuildActivity",
+        sa.Column(
+            "guild_id",
+            sa.BigInteger(),
+            primary_key=True,
+        ),
+        sa.Column(
+            "time",
+            sa.DateTime(),
+            primary_key=True,
+        ),
+        sa.Column(
+            "online",
+            sa.Integer(),
+            nullable=False,
+        ),
+        sa.Column(
+            "idle",
+            sa.Integer(),
+            nullable=False,
+        ),
+        sa.Column(
+            "dnd",
+            sa.Integer(),
+            nullable=False,
+        ),
+        sa.Column(
+            "offline",
+            sa.Integer(),
+            nullable=False,
+        ),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("GuildActivity")
@@ -0,0 +1,76 @@
+"""Create StatusStats materialized view
+
+Revision ID: a8e4d1c6f2b3
+Revises: 3f1c2b7d9e4a
+Create Date: 2026-10-19 11:03:27.550912
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "a8e4d1c6f2b3"
+down_revision = "3f1c2b7d9e4a"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Used both by the view's window functions and by the delta query
+    # over the entries newer than the watermark.
+    op.create_index(
+        "ix_StatusLog_guild_id_user_id_time",
+        "StatusLog",
+        ["guild_id", "user_id", "time"],
+    )
+
+    op.create_table(
+        "StatusStatsWatermark",
+        sa.Column(
+            "watermark",
+            sa.DateTime(),
+            nullable=False,
+        ),
+    )
+    op.execute(
+        """
+        INSERT INTO "StatusStatsWatermark" (watermark)
+        SELECT coalesce(max(time), '1970-01-01') FROM "StatusLog"
+        """
+    )
+
+    op.execute(
+        """
+        CREATE MATERIALIZED VIEW "StatusStats" AS
+        SELECT guild_id, user_id, status, sum(end_time - start_time) AS time
+        FROM (
+            SELECT
+                guild_id,
+                user_id,
+                before AS status,
+                time AS end_time,
+                lag(time) OVER w AS start_time,
+                lag(after) OVER w = before AS is_valid
+            FROM "StatusLog"
+            WHERE time <= (SELECT watermark FROM "StatusStatsWatermark")
+            WINDOW w AS (PARTITION BY guild_id, user_id ORDER BY time)
+        ) AS intervals
+        WHERE is_valid
+        GROUP BY guild_id, user_id, status
+        """
+    )
+
+    # Required by REFRESH MATERIALIZED VIEW CONCURRENTLY
+    op.execute(
+        """
+        CREATE UNIQUE INDEX "ix_StatusStats_guild_id_user_id_status"
+        ON "StatusStats" (guild_id, user_id, status)
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute('DROP MATERIALIZED VIEW "StatusStats"')
+    op.drop_table("StatusStatsWatermark")
+    op.drop_index("ix_StatusLog_guild_id_user_id_time", table_name="StatusLog")
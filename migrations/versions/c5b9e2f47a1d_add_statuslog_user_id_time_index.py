@@ -0,0 +1,25 @@
+"""Add StatusLog (user_id, time) index
+
+Revision ID: c5b9e2f47a1d
+Revises: a8e4d1c6f2b3
+Create Date: 2026-10-19 14:41:09.863120
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "c5b9e2f47a1d"
+down_revision = "a8e4d1c6f2b3"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Used for stats across all the guilds a user is in
+    op.create_index("ix_StatusLog_user_id_time", "StatusLog", ["user_id", "time"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_StatusLog_user_id_time", table_name="StatusLog")
@@ -1,4 +1,7 @@
+import asyncio
 import discord
+import logging
+import signal
 from sqlalchemy.ext.asyncio import create_async_engine
 
 from .bot import ObserverBot
@@ -7,13 +10,26 @@ from . import config
 from .bot import cogs
 
 
+log = logging.getLogger(__name__)
+
+
+def _log_warm_up_failure(task: asyncio.Task) -> None:
+    # The bot keeps starting; the first requests just end up slower
+    if not task.cancelled() and task.exception() is not None:
+        log.error("Failed to warm up", exc_info=task.exception())
+
+
 async def main():
     discord.utils.setup_logging()
 
     engine = create_async_engine(config.DATABASE_URI)
+    warm_up = None
 
     try:
-        repo = StatusLogRepository(engine)
+        repo = StatusLogRepository(
+            engine,
+            use_stats_view=config.STATS_VIEW_REFRESH_MINUTES > 0,
+        )
 
         bot = ObserverBot(
             guild_ids=config.GUILD_IDS,
@@ -24,17 +40,47 @@ async def main():
                 bot=bot,
                 repo=repo,
                 guild_ids=config.GUILD_IDS,
+                stats_view_refresh_minutes=config.STATS_VIEW_REFRESH_MINUTES,
+                shutdown_timeout=config.SHUTDOWN_TIMEOUT,
             )
         ),
 
+        await bot.add_cog(
+            cogs.Profiling(
+                bot=bot,
+                repo=repo,
+                output_dir=config.PROFILE_DIR,
+                profile_on_start=config.PROFILE_SECONDS,
+            )
+        )
+
+        # Open database connections while the gateway connection is being
+        # set up, instead of on the first presence update.
+        warm_up = asyncio.create_task(repo.warm_up())
+        warm_up.add_done_callback(_log_warm_up_failure)
+
         async with bot:
+            # Orchestrators stop the bot with SIGTERM. Closing the bot
+            # unloads the cogs first, which write the shutdown markers
+            # while the member cache is still there.
+            # Holds on to the task closing the bot
+            closing = []
+            try:
+                asyncio.get_running_loop().add_signal_handler(
+                    signal.SIGTERM,
+                    lambda: closing.append(asyncio.create_task(bot.close())),
+                )
+            except NotImplementedError:
+                # Signal handlers are not supported on Windows
+                pass
+
             await bot.start(config.BOT_TOKEN)
 
     finally:
+        if warm_up is not None:
+            warm_up.cancel()
         await engine.dispose()
 
 
 if __name__ == "__main__":
-    import asyncio
-
     asyncio.run(main())
@@ -1 +1,2 @@
 from .status_cog import Status
+from .profiling_cog import Profiling
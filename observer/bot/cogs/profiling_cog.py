@@ -0,0 +1,85 @@
+import asyncio
+import discord
+from discord.ext import commands
+import logging
+
+from ... import profiling
+from ...data import repository
+
+
+log = logging.getLogger(__name__)
+
+# Longest message discord accepts, minus the code block markup
+MAX_SUMMARY_LENGTH = 2000 - 8
+
+
+class Profiling(commands.Cog):
+    def __init__(
+        self,
+        bot: commands.Bot,
+        repo: repository.StatusLogRepository,
+        output_dir: str,
+        profile_on_start: float = 0,
+    ) -> None:
+        super().__init__()
+        self.bot = bot
+        self._repo = repo
+        self._output_dir = output_dir
+        self._profile_on_start = profile_on_start
+        # Held while profiling; instrumenting twice at once would leave
+        # wrappers behind
+        self._profiling_lock = asyncio.Lock()
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # on_ready fires again after reconnects; only profile the first start
+        if self._profile_on_start and not self._profiling_lock.locked():
+            seconds, self._profile_on_start = self._profile_on_start, 0
+            await self.profile_for(seconds)
+
+    async def profile_for(self, seconds: float) -> tuple[str, str]:
+        """Profiles the Status cog listeners and repository calls for a while
+
+        Returns the paths of the collapsed stacks and of the summary written
+        to the output directory.
+        """
+        profiler = profiling.Profiler()
+
+        async with self._profiling_lock:
+            try:
+                profiler.instrument(self._repo)
+                status = self.bot.get_cog("Status")
+                if status is not None:
+                    profiler.instrument_listeners(self.bot, status)
+
+                profiler.start()
+                await asyncio.sleep(seconds)
+
+            finally:
+                profiler.stop()
+
+        paths = await asyncio.to_thread(profiler.write, self._output_dir)
+        log.info("Wrote profile to %s and %s", *paths)
+
+        return paths
+
+    @commands.command()
+    @commands.is_owner()
+    async def profile(self, ctx: commands.Context, seconds: float = 30.0):
+        """
+        Profiles the bot for the given number of seconds and sends back the
+        slowest calls along with the collapsed stacks for a flamegraph.
+        """
+        # Two calls racing past this check get profiled one after the other
+        if self._profiling_lock.locked():
+            await ctx.send(content="Already profiling.")
+            return
+
+        await ctx.send(content=f"Profiling for {seconds:g}s...")
+
+        stacks_path, summary_path = await self.profile_for(seconds)
+
+        with open(summary_path) as fp:
+            summary = fp.read()[:MAX_SUMMARY_LENGTH]
+
+        await ctx.send(content=f"```\n{summary}\n```", file=discord.File(stacks_path))
@@ -1,9 +1,25 @@
+import asyncio
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 import datetime
-from typing import Optional
+import logging
+import sqlalchemy as sa
+from io import BytesIO
+from typing import Awaitable, Literal, Optional
 
-from ...data import repository
+from .. import concurrency
+from ...data import activity, imggen, models, repository
+
+
+log = logging.getLogger(__name__)
+
+# How often the in-memory activity samples are written to the database
+ACTIVITY_CHECKPOINT_INTERVAL = datetime.timedelta(minutes=15)
+
+# How many different `~stats` graphs are computed at once per guild, and
+# how many more may queue up before further requests are turned away
+STATS_CONCURRENCY = 2
+STATS_MAX_WAITING = 8
 
 
 class Status(commands.Cog):
@@ -12,61 +28,339 @@ class Status(commands.Cog):
         bot: commands.Bot,
         repo: repository.StatusLogRepository,
         guild_ids: list[int],
+        stats_view_refresh_minutes: int = 0,
+        shutdown_timeout: float = 8,
     ) -> None:
         super().__init__()
         self.bot = bot
         self.guild_ids = guild_ids
         self._repo = repo
+        self._stats_view_refresh_minutes = stats_view_refresh_minutes
+        self._shutdown_timeout = shutdown_timeout
         self._is_ready = False
+        self._has_logged_presence = False
+        self._activity = activity.GuildActivityTracker()
+        self._activity_checkpoint_lock = asyncio.Lock()
+        # Presence update handlers currently writing a status change
+        self._pending_writes: set[asyncio.Task] = set()
+        self._stats_flight = concurrency.SingleFlight()
+        self._stats_limiter = concurrency.KeyedLimiter(
+            concurrency=STATS_CONCURRENCY, max_waiting=STATS_MAX_WAITING
+        )
 
     @commands.Cog.listener()
     async def on_ready(self):
+        now = datetime.datetime.now()
+        restore_since = now - datetime.timedelta(minutes=self._activity.capacity)
+
         for guild_id in self.guild_ids:
             guild = self.bot.get_guild(guild_id) or await self.bot.fetch_guild(guild_id)
-            await self._repo.log_initial_statuses(
-                guild.members, guild_id, datetime.datetime.now()
+            await self._repo.log_initial_statuses(guild.members, guild_id, now)
+
+            # on_ready fires again after reconnects; only restore the
+            # checkpointed activity the first time around.
+            if not self._activity.samples(guild_id):
+                self._activity.restore(
+                    guild_id,
+                    await self._repo.get_guild_activity(guild_id, restore_since),
+                )
+
+            self._activity.reset(
+                guild_id, (member.status.name for member in guild.members)
             )
 
         self._is_ready = True
+        log.info("Logged initial statuses of %d guild(s)", len(self.guild_ids))
+
+        if not self._sample_activity.is_running():
+            self._sample_activity.start()
+
+        if not self._checkpoint_activity.is_running():
+            self._checkpoint_activity.start()
+
+        if self._repo.use_stats_view and not self._refresh_stats_view.is_running():
+            self._refresh_stats_view.change_interval(
+                minutes=self._stats_view_refresh_minutes
+            )
+            self._refresh_stats_view.start()
 
     async def cog_unload(self):
+        # Status changes coming in from now on would land after the
+        # shutdown markers.
+        self._is_ready = False
+
+        self._sample_activity.cancel()
+        self._checkpoint_activity.cancel()
+        self._refresh_stats_view.cancel()
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self._shutdown_timeout
+
+        pending = self._pending_writes - {asyncio.current_task()}
+        if pending:
+            _, pending = await asyncio.wait(pending, timeout=self._shutdown_timeout)
+            if pending:
+                log.warning(
+                    "%d status change(s) were not written before shutdown",
+                    len(pending),
+                )
+
+        now = datetime.datetime.now()
+        writes = {"activity checkpoint": self._write_activity_checkpoint()}
+
         for guild_id in self.guild_ids:
-            guild = self.bot.get_guild(guild_id) or await self.bot.fetch_guild(guild_id)
-            await self._repo.log_statuses_before_shutdown(
-                guild.members, guild_id, datetime.datetime.now()
+            # Only the cached members are known; REST calls do not return
+            # statuses, and there is no time for them anyway.
+            guild = self.bot.get_guild(guild_id)
+            if guild is None:
+                log.warning(
+                    "Guild %d is not cached, its shutdown markers were not written",
+                    guild_id,
+                )
+                continue
+
+            members = guild.members
+            writes[
+                f"shutdown markers of guild {guild_id} ({len(members)} members)"
+            ] = self._repo.log_statuses_before_shutdown(members, guild_id, now)
+
+        await self._write_before(deadline - loop.time(), writes)
+
+    async def _write_before(self, timeout: float, writes: dict[str, Awaitable]):
+        """Runs `writes` concurrently, logging the ones that did not complete"""
+        tasks = {asyncio.ensure_future(write): name for name, write in writes.items()}
+        done, pending = await asyncio.wait(tasks, timeout=max(timeout, 0))
+
+        for task in pending:
+            task.cancel()
+            log.warning("Gave up on writing the %s before shutdown", tasks[task])
+
+        for task in done:
+            if task.exception() is not None:
+                log.error(
+                    "Failed to write the %s before shutdown",
+                    tasks[task],
+                    exc_info=task.exception(),
+                )
+
+    @tasks.loop(minutes=1)
+    async def _sample_activity(self):
+        self._activity.sample(datetime.datetime.now())
+
+    @tasks.loop(seconds=ACTIVITY_CHECKPOINT_INTERVAL.total_seconds())
+    async def _checkpoint_activity(self):
+        # Member events missed while the gateway connection was down would
+        # otherwise skew the counters until the next reconnect.
+        self._resync_activity()
+
+        # Cancelling the loop must not interrupt a write half way, or the
+        # same samples could get written again on unload. A failed write
+        # keeps them pending for the next iteration.
+        try:
+            await asyncio.shield(self._write_activity_checkpoint())
+        except sa.exc.DBAPIError:
+            log.exception("Failed to write the activity checkpoint")
+
+    @tasks.loop(minutes=1)
+    async def _refresh_stats_view(self):
+        # Any other error than a connection one would stop the loop for good,
+        # and the delta queries would keep growing until the next on_ready.
+        try:
+            await self._repo.refresh_stats_view()
+        except sa.exc.DBAPIError:
+            log.exception("Failed to refresh the StatusStats view")
+
+    def _resync_activity(self):
+        for guild_id in self.guild_ids:
+            guild = self.bot.get_guild(guild_id)
+            if guild is not None:
+                self._activity.reset(
+                    guild_id, (member.status.name for member in guild.members)
+                )
+
+    async def _write_activity_checkpoint(self):
+        async with self._activity_checkpoint_lock:
+            pending = self._activity.pending_checkpoint()
+            for guild_id, samples in pending.items():
+                await self._repo.log_guild_activity(guild_id, samples)
+                self._activity.mark_checkpointed(guild_id, samples[-1].time)
+
+            # Nothing gets old enough to prune while nothing is being added
+            if not pending:
+                return
+
+            await self._repo.prune_guild_activity(
+                datetime.datetime.now()
+                - datetime.timedelta(minutes=self._activity.capacity)
             )
 
     @commands.command()
     async def stats(
-        self, ctx: commands.Context, target: Optional[discord.Member] = None
+        self,
+        ctx: commands.Context,
+        target: Optional[discord.Member] = None,
+        scope: Optional[Literal["--global"]] = None,
     ):
         """
         Draws a pie chat of amount of time you have spent with different
         statuses (online, idle, DnD, offline)
 
+        Pass --global to count the time across all the servers the bot
+        watches instead of just this one.
+
         don't ask me why.
         """
         if target is None:
             target = ctx.author
 
+        all_guilds = scope == "--global"
+
+        # People asking for the same graph at the same time share one
+        key = (None if all_guilds else ctx.guild.id, target.id)
+        if self._stats_flight.is_in_flight(key):
+            self._stats_limiter.metrics[ctx.guild.id].coalesced += 1
+
+        try:
+            image = await self._stats_flight.do(
+                key, lambda: self._draw_stats(ctx.guild.id, target, all_guilds)
+            )
+        except concurrency.QueueFull:
+            log.warning(
+                "Turned away ~stats in guild %d: %s",
+                ctx.guild.id,
+                self._stats_limiter.metrics[ctx.guild.id],
+            )
+            await ctx.send(content="Too many people are asking, try again later.")
+            return
+
+        if image is None:
+            await ctx.send(content="No data to show.")
+            return
+
+        await ctx.send(file=discord.File(BytesIO(image), filename="graph.png"))
+
+    @property
+    def stats_metrics(self) -> dict[int, concurrency.QueueMetrics]:
+        """Queue metrics of the `~stats` command, per guild"""
+        return dict(self._stats_limiter.metrics)
+
+    async def _draw_stats(
+        self, guild_id: int, target: discord.Member, all_guilds: bool
+    ) -> Optional[bytes]:
+        async with self._stats_limiter.acquire(guild_id):
+            await self._log_current_status(guild_id, target)
+
+            if all_guilds:
+                image = await self._repo.get_user_graph_all_guilds(target.id)
+            else:
+                image = await self._repo.get_user_graph(target.id, guild_id)
+
+        # The image is shared between callers, each needing their own file
+        return None if image is None else image.getvalue()
+
+    async def _log_current_status(self, guild_id: int, target: discord.Member):
         # Record an early log so that the most up-to date data gets shown by
-        # Subsequent `get_user_graph` call.
+        # Subsequent queries.
         if target.status is not None:
             await self._repo.log_status_change(
                 user_id=target.id,
-                guild_id=ctx.guild.id,
+                guild_id=guild_id,
                 before=target.status.name,
                 after=target.status.name,
                 timestamp=datetime.datetime.now(),
             )
 
-        image = await self._repo.get_user_graph(target.id, ctx.guild.id)
+    @commands.command()
+    async def sessions(
+        self, ctx: commands.Context, target: Optional[discord.Member] = None
+    ):
+        """
+        Shows how long you usually stay online, idle, on DnD or offline in
+        one go, and how many times a day
+        """
+        if target is None:
+            target = ctx.author
+
+        try:
+            async with self._stats_limiter.acquire(ctx.guild.id):
+                await self._log_current_status(ctx.guild.id, target)
+                stats = await self._repo.get_user_sessions(target.id, ctx.guild.id)
+        except concurrency.QueueFull:
+            await ctx.send(content="Too many people are asking, try again later.")
+            return
 
-        if image is None:
+        if not stats.histograms:
             await ctx.send(content="No data to show.")
             return
 
-        await ctx.send(file=discord.File(image, filename="graph.png"))
+        lines = [
+            f"{'status':<8} {'per day':>8} {'median':>8} {'p90':>8} {'p99':>8}",
+        ]
+        for status in models.Status:
+            histogram = stats.histograms.get(status)
+            if histogram is None:
+                continue
+
+            lines.append(
+                f"{status.name:<8} {stats.sessions_per_day(status):>8.1f}"
+                + "".join(
+                    f" {_format_duration(histogram.quantile(q)):>8}"
+                    for q in (0.5, 0.9, 0.99)
+                )
+            )
+
+        await ctx.send(
+            content=f"Sessions of {target.display_name} over"
+            f" {_format_duration(stats.tracked)} of tracked time:\n"
+            "```\n" + "\n".join(lines) + "\n```"
+        )
+
+    @commands.command()
+    async def activity(self, ctx: commands.Context):
+        """
+        Draws a line chart of how many members of this server were online,
+        idle and on DnD over the last day
+        """
+        # The buffer keeps its oldest samples around while the bot is down,
+        # only the ones within the last `capacity` minutes are shown.
+        since = datetime.datetime.now() - datetime.timedelta(
+            minutes=self._activity.capacity
+        )
+        samples = self._activity.samples(ctx.guild.id, since=since)
+
+        if len(samples) < 2:
+            await ctx.send(content="No data to show.")
+            return
+
+        # Points are placed by time, so that downtime shows up as a gap
+        minutes = activity.fill_gaps(samples)
+
+        image = await asyncio.to_thread(
+            imggen.graph.generate_activity_line_graph,
+            **{
+                status: [
+                    None if sample is None else getattr(sample, status)
+                    for sample in minutes
+                ]
+                for status in ("online", "idle", "dnd")
+            },
+        )
+
+        fp = BytesIO()
+        image.save(fp, format="png")
+        fp.seek(0)
+
+        await ctx.send(file=discord.File(fp, filename="activity.png"))
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member: discord.Member):
+        if self._is_ready and member.guild.id in self.guild_ids:
+            self._activity.record_join(member.guild.id, member.status.name)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: discord.Member):
+        if self._is_ready and member.guild.id in self.guild_ids:
+            self._activity.record_leave(member.guild.id, member.status.name)
 
     @commands.Cog.listener()
     async def on_presence_update(self, before: discord.Member, after: discord.Member):
@@ -77,10 +371,41 @@ class Status(commands.Cog):
             return
 
         if before.status != after.status:
-            await self._repo.log_status_change(
-                user_id=after.id,
-                guild_id=after.guild.id,
-                before=before.status.name,
-                after=after.status.name,
-                timestamp=datetime.datetime.now(),
+            self._activity.record_change(
+                after.guild.id, before.status.name, after.status.name
             )
+
+            # Waited for on unload, so that the write is not lost
+            task = asyncio.current_task()
+            self._pending_writes.add(task)
+            try:
+                await self._repo.log_status_change(
+                    user_id=after.id,
+                    guild_id=after.guild.id,
+                    before=before.status.name,
+                    after=after.status.name,
+                    timestamp=datetime.datetime.now(),
+                )
+            finally:
+                self._pending_writes.discard(task)
+
+            if not self._has_logged_presence:
+                self._has_logged_presence = True
+                log.info("Logged first presence update")
+
+
+def _format_duration(seconds: float) -> str:
+    seconds = round(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+
+    minutes, seconds = divmod(seconds, 60)
+    if minutes < 60:
+        return f"{minutes}m {seconds}s" if minutes < 10 else f"{minutes}m"
+
+    hours, minutes = divmod(minutes, 60)
+    if hours < 24:
+        return f"{hours}h {minutes}m"
+
+    days, hours = divmod(hours, 24)
+    return f"{days}d {hours}h"
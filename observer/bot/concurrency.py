@@ -0,0 +1,94 @@
+import asyncio
+import contextlib
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, Callable, Hashable, TypeVar
+
+
+T = TypeVar("T")
+
+
+class QueueFull(Exception):
+    """Raised when too many callers are already waiting for a slot"""
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into a single one
+
+    While a computation for a key is running, further callers with that
+    key wait for it and get its result (or exception) instead of starting
+    their own.
+    """
+
+    def __init__(self) -> None:
+        self._in_flight: dict[Hashable, asyncio.Future] = {}
+
+    def is_in_flight(self, key: Hashable) -> bool:
+        return key in self._in_flight
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        future = self._in_flight.get(key)
+
+        if future is None:
+            future = asyncio.ensure_future(func())
+            self._in_flight[key] = future
+
+            def forget(_):
+                if self._in_flight.get(key) is future:
+                    del self._in_flight[key]
+
+            future.add_done_callback(forget)
+
+        # A caller giving up must not cancel the computation for the others
+        return await asyncio.shield(future)
+
+
+@dataclass
+class QueueMetrics:
+    # Callers currently holding a slot
+    running: int = 0
+    # Callers currently waiting for a slot
+    waiting: int = 0
+    # Most callers ever seen waiting at once
+    max_waiting: int = 0
+    completed: int = 0
+    # Callers turned away because the queue was full
+    rejected: int = 0
+    # Callers that shared another caller's result
+    coalesced: int = 0
+
+
+class KeyedLimiter:
+    """Limits how many callers run at once per key, with a bounded queue"""
+
+    def __init__(self, concurrency: int, max_waiting: int) -> None:
+        self.concurrency = concurrency
+        self.max_waiting = max_waiting
+        self.metrics: defaultdict[Hashable, QueueMetrics] = defaultdict(QueueMetrics)
+        self._semaphores: defaultdict[Hashable, asyncio.Semaphore] = defaultdict(
+            lambda: asyncio.Semaphore(self.concurrency)
+        )
+
+    @contextlib.asynccontextmanager
+    async def acquire(self, key: Hashable) -> AsyncIterator[None]:
+        metrics = self.metrics[key]
+        semaphore = self._semaphores[key]
+
+        if semaphore.locked() and metrics.waiting >= self.max_waiting:
+            metrics.rejected += 1
+            raise QueueFull(key)
+
+        metrics.waiting += 1
+        metrics.max_waiting = max(metrics.max_waiting, metrics.waiting)
+        try:
+            await semaphore.acquire()
+        finally:
+            metrics.waiting -= 1
+
+        metrics.running += 1
+        try:
+            yield
+        finally:
+            metrics.running -= 1
+            metrics.completed += 1
+            semaphore.release()
@@ -13,3 +13,18 @@ TEST_DATABASE_URI = os.getenv("TEST_DATABASE_URI")
 GUILD_IDS = {
     int(guild_id) for guild_id in os.getenv("GUILD_IDS", "").split(";") if guild_id
 }
+
+# How often the StatusStats materialized view is refreshed, in minutes.
+# The view is not used at all when this is 0.
+STATS_VIEW_REFRESH_MINUTES = int(os.getenv("STATS_VIEW_REFRESH_MINUTES", "0"))
+
+# Profile the bot for this many seconds right after it starts, as with
+# the `~profile` command. Disabled when 0.
+PROFILE_SECONDS = float(os.getenv("PROFILE_SECONDS", "0"))
+# Where profiles are written to
+PROFILE_DIR = os.getenv("PROFILE_DIR", ".")
+
+# How long the bot may take to write its shutdown markers, in seconds.
+# Should stay below the time the process is given between SIGTERM and
+# being killed (10s for `docker stop`).
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "8"))
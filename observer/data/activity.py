@@ -0,0 +1,200 @@
+import array
+import datetime
+from collections import namedtuple
+from typing import Iterable, Optional, Union
+
+from .models import Status
+
+
+# One day of per-minute samples
+DEFAULT_CAPACITY = 24 * 60
+
+ActivitySample = namedtuple(
+    "ActivitySample", ["time", "online", "idle", "dnd", "offline"]
+)
+
+
+def _minute(timestamp: datetime.datetime) -> datetime.datetime:
+    return timestamp.replace(second=0, microsecond=0)
+
+
+def _status(status: Union[Status, str]) -> Status:
+    if isinstance(status, Status):
+        return status
+
+    # Anything discord reports that we do not track (eg. "invisible")
+    # is shown to other members as offline.
+    return Status.__members__.get(status, Status.offline)
+
+
+def fill_gaps(samples: list[ActivitySample]) -> list[Optional[ActivitySample]]:
+    """Spreads samples out to one per minute, with None for missing minutes
+
+    Minutes are missing when the bot was not running, eg. between restored
+    samples and the ones recorded since the restart.
+    """
+    if not samples:
+        return []
+
+    start = samples[0].time
+    length = int((samples[-1].time - start).total_seconds()) // 60 + 1
+
+    result = [None] * length
+    for sample in samples:
+        result[int((sample.time - start).total_seconds()) // 60] = sample
+
+    return result
+
+
+class ActivityRingBuffer:
+    """Fixed-size, array-backed buffer of per-minute online counts
+
+    Once full, the oldest sample is overwritten by the newest one.
+    Samples recorded within the same minute replace each other so that
+    the buffer holds at most one sample per minute.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY) -> None:
+        self.capacity = capacity
+
+        # Minutes since the epoch, used as the sample timestamp
+        self._minutes = array.array("q", [0]) * capacity
+        self._counts = {status: array.array("L", [0]) * capacity for status in Status}
+
+        # Index the next sample will be written to
+        self._head = 0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(self, sample: ActivitySample) -> None:
+        minute = int(_minute(sample.time).timestamp()) // 60
+
+        if self._size and self._minutes[self._head - 1] == minute:
+            index = self._head - 1
+        else:
+            index = self._head
+            self._head = (self._head + 1) % self.capacity
+            self._size = min(self._size + 1, self.capacity)
+
+        self._minutes[index] = minute
+        for status in Status:
+            self._counts[status][index] = getattr(sample, status.name)
+
+    def samples(
+        self, since: Optional[datetime.datetime] = None
+    ) -> list[ActivitySample]:
+        """Returns the buffered samples, oldest first"""
+        start = (self._head - self._size) % self.capacity
+        since_minute = None if since is None else int(since.timestamp()) // 60
+
+        result = []
+        for offset in range(self._size):
+            index = (start + offset) % self.capacity
+            minute = self._minutes[index]
+
+            if since_minute is not None and minute < since_minute:
+                continue
+
+            result.append(
+                ActivitySample(
+                    time=datetime.datetime.fromtimestamp(minute * 60),
+                    **{status.name: self._counts[status][index] for status in Status},
+                )
+            )
+
+        return result
+
+
+class GuildActivityTracker:
+    """Keeps live per-guild status counters and samples them over time
+
+    The counters are maintained from presence updates so that sampling
+    never has to look at the member list or the database.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY) -> None:
+        self.capacity = capacity
+        self._counts: dict[int, dict[Status, int]] = {}
+        self._buffers: dict[int, ActivityRingBuffer] = {}
+
+        # Time of the most recent sample written to the database, per guild
+        self._checkpointed: dict[int, datetime.datetime] = {}
+
+    def _buffer(self, guild_id: int) -> ActivityRingBuffer:
+        if guild_id not in self._buffers:
+            self._buffers[guild_id] = ActivityRingBuffer(self.capacity)
+
+        return self._buffers[guild_id]
+
+    def reset(self, guild_id: int, statuses: Iterable[Union[Status, str]]) -> None:
+        """Re-initializes the counters of a guild from its current member statuses"""
+        counts = {status: 0 for status in Status}
+        for status in statuses:
+            counts[_status(status)] += 1
+
+        self._counts[guild_id] = counts
+
+    def record_join(self, guild_id: int, status: Union[Status, str]) -> None:
+        counts = self._counts.get(guild_id)
+        if counts is not None:
+            counts[_status(status)] += 1
+
+    def record_leave(self, guild_id: int, status: Union[Status, str]) -> None:
+        counts = self._counts.get(guild_id)
+        if counts is not None and counts[_status(status)] > 0:
+            counts[_status(status)] -= 1
+
+    def record_change(
+        self,
+        guild_id: int,
+        before: Union[Status, str],
+        after: Union[Status, str],
+    ) -> None:
+        self.record_leave(guild_id, before)
+        self.record_join(guild_id, after)
+
+    def restore(self, guild_id: int, samples: Iterable[ActivitySample]) -> None:
+        """Loads samples previously checkpointed to the database"""
+        buffer = self._buffer(guild_id)
+        for sample in samples:
+            buffer.append(sample)
+            self._checkpointed[guild_id] = sample.time
+
+    def sample(self, timestamp: datetime.datetime) -> None:
+        """Appends the current counters of every known guild to its buffer"""
+        for guild_id, counts in self._counts.items():
+            self._buffer(guild_id).append(
+                ActivitySample(
+                    time=_minute(timestamp),
+                    **{status.name: count for status, count in counts.items()},
+                )
+            )
+
+    def samples(
+        self, guild_id: int, since: Optional[datetime.datetime] = None
+    ) -> list[ActivitySample]:
+        if guild_id not in self._buffers:
+            return []
+
+        return self._buffers[guild_id].samples(since)
+
+    def pending_checkpoint(self) -> dict[int, list[ActivitySample]]:
+        """Returns the samples not yet written to the database, per guild"""
+        pending = {}
+        for guild_id, buffer in self._buffers.items():
+            last = self._checkpointed.get(guild_id)
+            samples = [
+                sample
+                for sample in buffer.samples(last)
+                if last is None or sample.time > last
+            ]
+
+            if samples:
+                pending[guild_id] = samples
+
+        return pending
+
+    def mark_checkpointed(self, guild_id: int, timestamp: datetime.datetime) -> None:
+        self._checkpointed[guild_id] = timestamp
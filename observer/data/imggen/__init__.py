@@ -1 +1,10 @@
-from . import graph
+import importlib
+
+
+# `graph` pulls in Pillow, which takes a while to import and is not needed
+# until the first graph is drawn, so it is only imported on first access.
+def __getattr__(name: str):
+    if name == "graph":
+        return importlib.import_module(f"{__name__}.graph")
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,4 +1,5 @@
 from PIL import Image, ImageDraw
+from typing import Optional
 
 
 Color = tuple[int, int, int]
@@ -18,6 +19,12 @@ GRAPH_IMAGE_SIZE = (GRAPH_IMAGE_WIDTH, GRAPH_IMAGE_HEIGHT)
 GRAPH_IMAGE_FILL_COLOR = 0
 GRAPH_ARCH_WIDTH = round(GRAPH_IMAGE_HEIGHT * 0.2)
 
+LINE_GRAPH_IMAGE_WIDTH = 1440
+LINE_GRAPH_IMAGE_HEIGHT = 500
+LINE_GRAPH_IMAGE_SIZE = (LINE_GRAPH_IMAGE_WIDTH, LINE_GRAPH_IMAGE_HEIGHT)
+LINE_GRAPH_PADDING = 20
+LINE_GRAPH_LINE_WIDTH = 3
+
 ONLINE_COLOR = _color(0x3BA55C)
 IDLE_COLOR = _color(0xFAA61A)
 DND_COLOR = _color(0xED4245)
@@ -59,3 +66,59 @@ def generate_status_pie_graph(
     ]
 
     return generate_pie_graph(values)
+
+
+def generate_line_graph(series: list[tuple[list[Optional[int]], Color]]) -> Image:
+    """Draws evenly spaced values as lines, broken where a value is None"""
+    img = Image.new("RGBA", LINE_GRAPH_IMAGE_SIZE, color=GRAPH_IMAGE_FILL_COLOR)
+    draw = ImageDraw.ImageDraw(img)
+
+    # All lines share the same scale so that they can be compared
+    known = [value for values, _ in series for value in values if value is not None]
+    peak = max(known, default=0) or 1
+    length = max((len(values) for values, _ in series), default=0)
+
+    width = LINE_GRAPH_IMAGE_WIDTH - 2 * LINE_GRAPH_PADDING
+    height = LINE_GRAPH_IMAGE_HEIGHT - 2 * LINE_GRAPH_PADDING
+    step = width / max(length - 1, 1)
+
+    for values, color in series:
+        runs = [[]]
+        for index, value in enumerate(values):
+            if value is None:
+                runs.append([])
+                continue
+
+            runs[-1].append(
+                (
+                    LINE_GRAPH_PADDING + index * step,
+                    LINE_GRAPH_PADDING + height * (1 - value / peak),
+                )
+            )
+
+        for points in runs:
+            if len(points) > 1:
+                draw.line(points, fill=color, width=LINE_GRAPH_LINE_WIDTH)
+            elif points:
+                # A lone value between two gaps still deserves a mark
+                ((x, y),) = points
+                radius = LINE_GRAPH_LINE_WIDTH
+                draw.ellipse(
+                    (x - radius, y - radius, x + radius, y + radius), fill=color
+                )
+
+    return img
+
+
+def generate_activity_line_graph(
+    online: list[Optional[int]],
+    idle: list[Optional[int]],
+    dnd: list[Optional[int]],
+) -> Image:
+    series = [
+        (online, ONLINE_COLOR),
+        (idle, IDLE_COLOR),
+        (dnd, DND_COLOR),
+    ]
+
+    return generate_line_graph(series)
@@ -40,4 +40,64 @@ StatusLog = sa.Table(
         sa.DateTime(),
         nullable=False,
     ),
+    sa.Index("ix_StatusLog_guild_id_user_id_time", "guild_id", "user_id", "time"),
+    sa.Index("ix_StatusLog_user_id_time", "user_id", "time"),
+)
+
+
+# Per-minute online counts of a guild, checkpointed from the in-memory
+# `activity.GuildActivityTracker`
+GuildActivity = sa.Table(
+    "GuildActivity",
+    metadata,
+    sa.Column(
+        "guild_id",
+        sa.BigInteger(),
+        primary_key=True,
+    ),
+    sa.Column(
+        "time",
+        sa.DateTime(),
+        primary_key=True,
+    ),
+    sa.Column(
+        "online",
+        sa.Integer(),
+        nullable=False,
+    ),
+    sa.Column(
+        "idle",
+        sa.Integer(),
+        nullable=False,
+    ),
+    sa.Column(
+        "dnd",
+        sa.Integer(),
+        nullable=False,
+    ),
+    sa.Column(
+        "offline",
+        sa.Integer(),
+        nullable=False,
+    ),
+)
+
+
+# The following are created by a migration rather than through `metadata`
+# since `create_all` cannot create materialized views.
+
+# Single row holding the time up to which `StatusStats` is computed
+StatusStatsWatermark = sa.table(
+    "StatusStatsWatermark",
+    sa.column("watermark", sa.DateTime()),
+)
+
+# Materialized view with the total time spent per (guild, user, status),
+# over the `StatusLog` entries up to the watermark
+StatusStats = sa.table(
+    "StatusStats",
+    sa.column("guild_id", sa.BigInteger()),
+    sa.column("user_id", sa.BigInteger()),
+    sa.column("status", sa.Enum(Status)),
+    sa.column("time", sa.Interval()),
 )
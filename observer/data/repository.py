@@ -1,37 +1,295 @@
 import asyncio
-import discord
 import datetime
+import importlib
 import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.ext.asyncio import AsyncEngine
 from io import BytesIO
-from typing import Optional
+from typing import Optional, TYPE_CHECKING
 
-from .models import StatusLog
-from .imggen import graph
+from .models import Status, StatusLog, GuildActivity, StatusStats, StatusStatsWatermark
+from .activity import ActivitySample
+from .sessions import SessionStats
+from . import imggen
+
+if TYPE_CHECKING:
+    import discord
+
+
+# How far behind the current time the `StatusStats` watermark is kept, so
+# that entries still being written when the view is refreshed are not missed
+STATS_VIEW_WATERMARK_DELAY = datetime.timedelta(minutes=1)
+
+
+# How many intervals are fetched at once when streaming a user's history
+SESSIONS_BATCH_SIZE = 1000
+
+
+# The statements below are built once and executed with the ids bound as
+# parameters, instead of being rebuilt on every call.
+_USER_ID = sa.bindparam("user_id", type_=sa.BigInteger())
+_GUILD_ID = sa.bindparam("guild_id", type_=sa.BigInteger())
+
+
+def _user_intervals() -> sa.Select:
+    """Pairs each entry of a user in a guild with the one before it"""
+    return (
+        sa.select(
+            StatusLog.c.before.label("status"),
+            StatusLog.c.time.label("end_time"),
+            sa.func.lag(StatusLog.c.time)
+            .over(order_by=StatusLog.c.time)
+            .label("start_time"),
+            (
+                sa.func.lag(StatusLog.c.after).over(order_by=StatusLog.c.time)
+                == StatusLog.c.before
+            ).label("is_valid"),
+        )
+        .select_from(StatusLog)
+        .where(StatusLog.c.user_id == _USER_ID)
+        .where(StatusLog.c.guild_id == _GUILD_ID)
+    )
+
+
+def _user_stats_query() -> sa.Select:
+    subquery = _user_intervals().subquery()
+
+    query = (
+        sa.select(
+            subquery.c.status.label("status"),
+            sa.func.sum(subquery.c.end_time - subquery.c.start_time).label("time"),
+        )
+        .where(subquery.c.is_valid)
+        .group_by(subquery.c.status)
+    )
+
+    return query
+
+
+def _user_intervals_query() -> sa.Select:
+    subquery = _user_intervals().subquery()
+
+    query = (
+        sa.select(subquery.c.status, subquery.c.start_time, subquery.c.end_time)
+        .where(subquery.c.is_valid)
+        .order_by(subquery.c.end_time)
+    )
+
+    return query
+
+
+def _user_stats_from_view_query() -> sa.Select:
+    watermark = sa.select(StatusStatsWatermark.c.watermark).scalar_subquery()
+
+    # The most recent entry covered by the view is needed to pair it
+    # with the first entry after the watermark.
+    delta_start = (
+        sa.select(sa.func.max(StatusLog.c.time))
+        .where(StatusLog.c.user_id == _USER_ID)
+        .where(StatusLog.c.guild_id == _GUILD_ID)
+        .where(StatusLog.c.time <= watermark)
+        .scalar_subquery()
+    )
+
+    delta = (
+        _user_intervals()
+        .where(StatusLog.c.time >= sa.func.coalesce(delta_start, watermark))
+        .subquery()
+    )
+
+    totals = sa.union_all(
+        sa.select(
+            StatusStats.c.status.label("status"),
+            StatusStats.c.time.label("time"),
+        )
+        .where(StatusStats.c.user_id == _USER_ID)
+        .where(StatusStats.c.guild_id == _GUILD_ID),
+        sa.select(
+            delta.c.status.label("status"),
+            (delta.c.end_time - delta.c.start_time).label("time"),
+        )
+        .where(delta.c.is_valid)
+        .where(delta.c.end_time > watermark),
+    ).subquery()
+
+    query = sa.select(
+        totals.c.status.label("status"),
+        sa.func.sum(totals.c.time).label("time"),
+    ).group_by(totals.c.status)
+
+    return query
+
+
+def _user_stats_all_guilds_query() -> sa.Select:
+    window = {"partition_by": StatusLog.c.guild_id, "order_by": StatusLog.c.time}
+
+    intervals = (
+        sa.select(
+            StatusLog.c.before.label("status"),
+            sa.func.lag(StatusLog.c.time).over(**window).label("start_time"),
+            StatusLog.c.time.label("end_time"),
+            (sa.func.lag(StatusLog.c.after).over(**window) == StatusLog.c.before).label(
+                "is_valid"
+            ),
+        )
+        .select_from(StatusLog)
+        .where(StatusLog.c.user_id == _USER_ID)
+        .subquery()
+    )
+
+    # Latest end among the earlier intervals with the same status; an
+    # interval starting after it begins a new run of merged intervals.
+    ordered = {
+        "partition_by": intervals.c.status,
+        "order_by": (intervals.c.start_time, intervals.c.end_time),
+    }
+    previous_end = (
+        sa.select(
+            intervals.c.status,
+            intervals.c.start_time,
+            intervals.c.end_time,
+            sa.func.max(intervals.c.end_time)
+            .over(**ordered, rows=(None, -1))
+            .label("previous_end"),
+        )
+        .where(intervals.c.is_valid)
+        .subquery()
+    )
+
+    runs = sa.select(
+        previous_end.c.status,
+        previous_end.c.start_time,
+        previous_end.c.end_time,
+        sa.func.count(
+            sa.case(
+                (
+                    sa.or_(
+                        previous_end.c.previous_end.is_(None),
+                        previous_end.c.start_time > previous_end.c.previous_end,
+                    ),
+                    1,
+                )
+            )
+        )
+        .over(
+            partition_by=previous_end.c.status,
+            order_by=(previous_end.c.start_time, previous_end.c.end_time),
+        )
+        .label("run"),
+    ).subquery()
+
+    merged = (
+        sa.select(
+            runs.c.status,
+            (sa.func.max(runs.c.end_time) - sa.func.min(runs.c.start_time)).label(
+                "time"
+            ),
+        )
+        .group_by(runs.c.status, runs.c.run)
+        .subquery()
+    )
+
+    query = sa.select(
+        merged.c.status.label("status"),
+        sa.func.sum(merged.c.time).label("time"),
+    ).group_by(merged.c.status)
+
+    return query
+
+
+INSERT_STATUS_LOG = StatusLog.insert()
+USER_STATS_QUERY = _user_stats_query()
+USER_INTERVALS_QUERY = _user_intervals_query()
+USER_STATS_FROM_VIEW_QUERY = _user_stats_from_view_query()
+USER_STATS_ALL_GUILDS_QUERY = _user_stats_all_guilds_query()
+
+
+def _status_name(status) -> Optional[str]:
+    return status.name if isinstance(status, Status) else status
 
 
 class StatusLogRepository:
-    def __init__(self, engine: AsyncEngine) -> None:
+    def __init__(
+        self,
+        engine: AsyncEngine,
+        use_stats_view: bool = False,
+        use_raw_inserts: bool = True,
+    ) -> None:
         self._engine = engine
 
+        # The materialized view only exists on PostgreSQL
+        self.use_stats_view = use_stats_view and engine.dialect.name == "postgresql"
+
+        # Single status changes can be inserted straight through asyncpg,
+        # which prepares the statement once per connection and reuses it.
+        self.use_raw_inserts = use_raw_inserts and engine.dialect.driver == "asyncpg"
+        if self.use_raw_inserts:
+            compiled = INSERT_STATUS_LOG.compile(dialect=engine.dialect)
+            self._raw_insert_sql = str(compiled)
+            self._raw_insert_params = compiled.positiontup
+
+        # Another instance, e.g. during a rolling restart, or a retried
+        # checkpoint can already have written a sample taken at the same time.
+        self._insert_guild_activity = GuildActivity.insert()
+        if engine.dialect.name == "postgresql":
+            self._insert_guild_activity = postgresql.insert(
+                GuildActivity
+            ).on_conflict_do_nothing(index_elements=["guild_id", "time"])
+
+    async def warm_up(self) -> None:
+        """Gets the slow parts of the first requests out of the way
+
+        Meant to run in the background while the bot logs in: fills the
+        connection pool and imports the graph module (and Pillow with it)
+        on a worker thread.
+        """
+
+        async def connect():
+            async with self._engine.connect() as conn:
+                await conn.execute(sa.text("SELECT 1"))
+
+        # Connections only get added to the pool when they are all opened
+        # at the same time.
+        pool_size = getattr(self._engine.pool, "size", lambda: 1)()
+
+        await asyncio.gather(
+            *(connect() for _ in range(pool_size)),
+            asyncio.to_thread(importlib.import_module, f"{imggen.__name__}.graph"),
+        )
+
     async def log_status_change(
         self, user_id, guild_id, before, after, timestamp
     ) -> None:
+        entry = {
+            "user_id": user_id,
+            "guild_id": guild_id,
+            "before": before,
+            "after": after,
+            "time": timestamp,
+        }
+
+        if self.use_raw_inserts:
+            await self._raw_log_status_change(entry)
+            return
+
         async with self._engine.begin() as conn:
-            await conn.execute(
-                StatusLog.insert(),
-                {
-                    "user_id": user_id,
-                    "guild_id": guild_id,
-                    "before": before,
-                    "after": after,
-                    "time": timestamp,
-                },
+            await conn.execute(INSERT_STATUS_LOG, entry)
+
+    async def _raw_log_status_change(self, entry: dict) -> None:
+        entry["before"] = _status_name(entry["before"])
+        entry["after"] = _status_name(entry["after"])
+
+        async with self._engine.connect() as conn:
+            raw = await conn.get_raw_connection()
+            # A single statement outside of a transaction commits by itself
+            await raw.driver_connection.execute(
+                self._raw_insert_sql,
+                *(entry[name] for name in self._raw_insert_params),
             )
 
     async def log_initial_statuses(
         self,
-        members: list[discord.Member],
+        members: list["discord.Member"],
         guild_id: int,
         startup_time: datetime.datetime,
     ) -> None:
@@ -47,11 +305,11 @@ class StatusLogRepository:
         ]
 
         async with self._engine.begin() as conn:
-            await conn.execute(StatusLog.insert(), entires)
+            await conn.execute(INSERT_STATUS_LOG, entires)
 
     async def log_statuses_before_shutdown(
         self,
-        members: list[discord.Member],
+        members: list["discord.Member"],
         guild_id: int,
         shutdown_time: datetime.datetime,
     ) -> None:
@@ -67,43 +325,85 @@ class StatusLogRepository:
         ]
 
         async with self._engine.begin() as conn:
-            await conn.execute(StatusLog.insert(), entires)
+            await conn.execute(INSERT_STATUS_LOG, entires)
 
     async def get_user_stats(self, user_id, guild_id):
-        subquery = (
-            sa.select(
-                StatusLog.c.before.label("status"),
-                StatusLog.c.time.label("end_time"),
-                sa.func.lag(StatusLog.c.time)
-                .over(order_by=StatusLog.c.time)
-                .label("start_time"),
-                (
-                    sa.func.lag(StatusLog.c.after).over(order_by=StatusLog.c.time)
-                    == StatusLog.c.before
-                ).label("is_valid"),
+        if self.use_stats_view:
+            return await self._get_user_stats_from_view(user_id, guild_id)
+
+        async with self._engine.connect() as conn:
+            result = await conn.execute(
+                USER_STATS_QUERY, {"user_id": user_id, "guild_id": guild_id}
             )
-            .select_from(StatusLog)
-            .where(StatusLog.c.user_id == user_id)
-            .where(StatusLog.c.guild_id == guild_id)
-            .subquery()
-        )
+            return result.fetchall()
 
-        query = (
-            sa.select(
-                subquery.c.status.label("status"),
-                sa.func.sum(subquery.c.end_time - subquery.c.start_time).label("time"),
+    async def _get_user_stats_from_view(self, user_id, guild_id):
+        async with self._engine.connect() as conn:
+            result = await conn.execute(
+                USER_STATS_FROM_VIEW_QUERY, {"user_id": user_id, "guild_id": guild_id}
+            )
+            return result.fetchall()
+
+    async def refresh_stats_view(self) -> None:
+        """Moves the watermark forward and recomputes `StatusStats`
+
+        The view is refreshed concurrently so that it can still be read
+        in the meantime; readers keep seeing the old watermark along with
+        the old totals until the transaction commits.
+        """
+        watermark = datetime.datetime.now() - STATS_VIEW_WATERMARK_DELAY
+
+        async with self._engine.begin() as conn:
+            await conn.execute(
+                StatusStatsWatermark.update().values(watermark=watermark)
+            )
+            await conn.execute(
+                sa.text('REFRESH MATERIALIZED VIEW CONCURRENTLY "StatusStats"')
             )
-            .where(subquery.c.is_valid)
-            .group_by(subquery.c.status)
-        )
 
+    async def get_user_stats_all_guilds(self, user_id):
+        """Total time per status of a user, across all the guilds
+
+        A presence change shows up in every guild the user shares with the
+        bot, so overlapping intervals with the same status are merged
+        before being added up; time is never counted twice.
+        """
         async with self._engine.connect() as conn:
-            result = await conn.execute(query)
+            result = await conn.execute(
+                USER_STATS_ALL_GUILDS_QUERY, {"user_id": user_id}
+            )
             return result.fetchall()
 
+    async def get_user_sessions(self, user_id, guild_id) -> SessionStats:
+        """Lengths of the sessions of a user in each status
+
+        The intervals are read through a server-side cursor and folded into
+        histograms as they arrive, so that the history of heavy users never
+        has to be held in memory at once.
+        """
+        stats = SessionStats()
+
+        async with self._engine.connect() as conn:
+            result = await conn.stream(
+                USER_INTERVALS_QUERY, {"user_id": user_id, "guild_id": guild_id}
+            )
+
+            async for rows in result.partitions(SESSIONS_BATCH_SIZE):
+                for status, start_time, end_time in rows:
+                    stats.add_interval(status, start_time, end_time)
+
+        stats.finish()
+        return stats
+
     async def get_user_graph(self, user_id: int, guild_id: int) -> Optional[BytesIO]:
         stats = await self.get_user_stats(user_id=user_id, guild_id=guild_id)
+        return await self._draw_stats_graph(stats)
+
+    async def get_user_graph_all_guilds(self, user_id: int) -> Optional[BytesIO]:
+        stats = await self.get_user_stats_all_guilds(user_id=user_id)
+        return await self._draw_stats_graph(stats)
 
+    async def _draw_stats_graph(self, stats) -> Optional[BytesIO]:
         if not stats:
             return None
 
@@ -113,7 +413,9 @@ class StatusLogRepository:
             stat.status.name: stat.time.total_seconds() / total_time for stat in stats
         }
 
-        image = await asyncio.to_thread(graph.generate_status_pie_graph, **values)
+        image = await asyncio.to_thread(
+            imggen.graph.generate_status_pie_graph, **values
+        )
 
         fp = BytesIO()
         fp.name = "graph.png"
@@ -121,3 +423,38 @@ class StatusLogRepository:
         fp.seek(0)
 
         return fp
+
+    async def log_guild_activity(
+        self, guild_id: int, samples: list[ActivitySample]
+    ) -> None:
+        entries = [{"guild_id": guild_id, **sample._asdict()} for sample in samples]
+
+        async with self._engine.begin() as conn:
+            await conn.execute(self._insert_guild_activity, entries)
+
+    async def prune_guild_activity(self, older_than: datetime.datetime) -> None:
+        """Deletes the samples that would not fit in the buffers anymore"""
+        async with self._engine.begin() as conn:
+            await conn.execute(
+                GuildActivity.delete().where(GuildActivity.c.time < older_than)
+            )
+
+    async def get_guild_activity(
+        self, guild_id: int, since: datetime.datetime
+    ) -> list[ActivitySample]:
+        query = (
+            sa.select(
+                GuildActivity.c.time,
+                GuildActivity.c.online,
+                GuildActivity.c.idle,
+                GuildActivity.c.dnd,
+                GuildActivity.c.offline,
+            )
+            .where(GuildActivity.c.guild_id == guild_id)
+            .where(GuildActivity.c.time >= since)
+            .order_by(GuildActivity.c.time)
+        )
+
+        async with self._engine.connect() as conn:
+            result = await conn.execute(query)
+            return [ActivitySample(*row) for row in result]
@@ -0,0 +1,159 @@
+import datetime
+import math
+from array import array
+from typing import Optional
+
+from .models import Status
+
+
+# Session lengths are tracked in seconds, up to a year
+DEFAULT_MIN_VALUE = 1.0
+DEFAULT_MAX_VALUE = 365 * 24 * 60 * 60.0
+DEFAULT_RELATIVE_ERROR = 0.02
+
+
+class LogHistogram:
+    """Counts values in buckets whose bounds grow geometrically
+
+    Quantiles are within `relative_error` of the true value for values
+    between `min_value` and `max_value`. The buckets are fixed, so two
+    histograms with the same parameters merge by adding up their counts.
+    """
+
+    def __init__(
+        self,
+        relative_error: float = DEFAULT_RELATIVE_ERROR,
+        min_value: float = DEFAULT_MIN_VALUE,
+        max_value: float = DEFAULT_MAX_VALUE,
+    ) -> None:
+        self.relative_error = relative_error
+        self.min_value = min_value
+        self.max_value = max_value
+
+        # Bucket i > 0 holds the values in (min * gamma^(i-1), min * gamma^i],
+        # bucket 0 everything up to `min_value`.
+        self._gamma = (1 + relative_error) / (1 - relative_error)
+        self._log_gamma = math.log(self._gamma)
+        size = math.ceil(math.log(max_value / min_value) / self._log_gamma) + 1
+        self._counts = array("Q", [0]) * size
+
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _index(self, value: float) -> int:
+        if value <= self.min_value:
+            return 0
+
+        index = math.ceil(math.log(value / self.min_value) / self._log_gamma)
+        return min(index, len(self._counts) - 1)
+
+    def add(self, value: float) -> None:
+        self._counts[self._index(value)] += 1
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other: "LogHistogram") -> None:
+        if (other.relative_error, other.min_value, other.max_value) != (
+            self.relative_error,
+            self.min_value,
+            self.max_value,
+        ):
+            raise ValueError("Histograms with different buckets cannot be merged")
+
+        for index, count in enumerate(other._counts):
+            self._counts[index] += count
+
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+
+        rank = math.floor(q * (self.count - 1))
+
+        # The exact extremes are known, and are better than any estimate
+        if rank == 0:
+            return self.min
+        if rank == self.count - 1:
+            return self.max
+
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if seen > rank:
+                break
+
+        if index == 0:
+            value = self.min_value
+        else:
+            # The point of the bucket with the same relative distance to
+            # both of its bounds
+            value = self.min_value * self._gamma**index * 2 / (self._gamma + 1)
+
+        return min(max(value, self.min), self.max)
+
+
+class SessionStats:
+    """Lengths of the uninterrupted stretches a user spent in each status
+
+    Fed with the intervals between consecutive status log entries, in
+    order. Adjacent intervals with the same status make up one session;
+    the early logs written by `~stats` split them in two.
+    """
+
+    def __init__(self) -> None:
+        self.histograms: dict[Status, LogHistogram] = {}
+        # Total time covered by the intervals, in seconds
+        self.tracked = 0.0
+
+        self._status: Optional[Status] = None
+        self._start: Optional[datetime.datetime] = None
+        self._end: Optional[datetime.datetime] = None
+
+    def add_interval(
+        self, status: Status, start: datetime.datetime, end: datetime.datetime
+    ) -> None:
+        if end <= start:
+            return
+
+        self.tracked += (end - start).total_seconds()
+
+        if status == self._status and start == self._end:
+            self._end = end
+            return
+
+        self.finish()
+        self._status, self._start, self._end = status, start, end
+
+    def finish(self) -> None:
+        """Counts the session still being built up"""
+        if self._status is None:
+            return
+
+        histogram = self.histograms.get(self._status)
+        if histogram is None:
+            histogram = self.histograms[self._status] = LogHistogram()
+
+        histogram.add((self._end - self._start).total_seconds())
+        self._status = None
+
+    def sessions_per_day(self, status: Status) -> float:
+        days = self.tracked / (24 * 60 * 60)
+        histogram = self.histograms.get(status)
+
+        if histogram is None or not days:
+            return 0.0
+
+        return histogram.count / days
@@ -0,0 +1,231 @@
+import collections
+import datetime
+import functools
+import inspect
+import os
+import sys
+import threading
+import time
+from typing import Callable, Iterable, Optional
+
+from discord.ext import commands
+
+
+SlowCall = collections.namedtuple("SlowCall", ["name", "time", "duration"])
+
+
+class CallStats:
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+class Profiler:
+    """Samples the stacks of all threads and times instrumented coroutines
+
+    Nothing is patched until `instrument` or `instrument_listeners` is
+    called, and everything is restored by `stop`, so an idle profiler does
+    not slow anything down.
+    """
+
+    def __init__(
+        self,
+        interval: float = 0.01,
+        slow_call_threshold: float = 0.05,
+        max_slow_calls: int = 100,
+    ) -> None:
+        self.interval = interval
+        self.slow_call_threshold = slow_call_threshold
+
+        # Number of times each collapsed stack was seen, flamegraph style
+        self.stacks: collections.Counter[str] = collections.Counter()
+        self.calls: dict[str, CallStats] = collections.defaultdict(CallStats)
+        self.slow_calls: collections.deque[SlowCall] = collections.deque(
+            maxlen=max_slow_calls
+        )
+
+        self.started_at: Optional[datetime.datetime] = None
+        self.duration = 0.0
+
+        self._started = 0.0
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+        # Callbacks undoing the patches made by `instrument*`
+        self._restore: list[Callable[[], None]] = []
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None
+
+    def _record(self, name: str, duration: float) -> None:
+        stats = self.calls[name]
+        stats.count += 1
+        stats.total += duration
+        stats.max = max(stats.max, duration)
+
+        if duration >= self.slow_call_threshold:
+            self.slow_calls.append(SlowCall(name, datetime.datetime.now(), duration))
+
+    def wrap(self, name: str, func: Callable) -> Callable:
+        """Returns a version of the coroutine function `func` that gets timed"""
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                self._record(name, time.perf_counter() - started)
+
+        return wrapper
+
+    def instrument(self, obj: object, names: Optional[Iterable[str]] = None) -> None:
+        """Times calls to coroutine methods of `obj`
+
+        All public coroutine methods are instrumented unless `names` is given.
+        """
+        if names is None:
+            names = [
+                name
+                for name, _ in inspect.getmembers(
+                    type(obj), inspect.iscoroutinefunction
+                )
+                if not name.startswith("_")
+            ]
+
+        names = list(names)
+        for name in names:
+            if name in vars(obj):
+                raise ValueError(f"{type(obj).__name__}.{name} is already instrumented")
+
+        for name in names:
+            # Shadow the method with an instance attribute; deleting it
+            # brings the original back.
+            setattr(
+                obj,
+                name,
+                self.wrap(f"{type(obj).__name__}.{name}", getattr(obj, name)),
+            )
+            self._restore.append(functools.partial(delattr, obj, name))
+
+    def instrument_listeners(self, bot: commands.Bot, cog: commands.Cog) -> None:
+        """Times the event listeners of `cog`"""
+        listeners = cog.get_listeners()
+
+        # A listener already swapped out for a wrapper is no longer registered
+        for event, listener in listeners:
+            if listener not in bot.extra_events.get(event, []):
+                raise ValueError(
+                    f"{cog.qualified_name}.{listener.__name__} is not registered"
+                    " or already instrumented"
+                )
+
+        for event, listener in listeners:
+            wrapper = self.wrap(f"{cog.qualified_name}.{listener.__name__}", listener)
+
+            bot.remove_listener(listener, event)
+            bot.add_listener(wrapper, event)
+
+            def restore(event=event, listener=listener, wrapper=wrapper):
+                bot.remove_listener(wrapper, event)
+                bot.add_listener(listener, event)
+
+            self._restore.append(restore)
+
+    def start(self) -> None:
+        self.started_at = datetime.datetime.now()
+        self._started = time.perf_counter()
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._sample, name="profiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            self.duration = time.perf_counter() - self._started
+
+        while self._restore:
+            self._restore.pop()()
+
+    def _sample(self) -> None:
+        own_id = threading.get_ident()
+
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(
+                        f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+                    )
+                    frame = frame.f_back
+
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def summary(self, top: int = 10) -> str:
+        lines = [
+            f"Profiled {self.duration:.1f}s, {sum(self.stacks.values())} samples",
+            "",
+            "Calls (by total time):",
+        ]
+
+        by_total = sorted(self.calls.items(), key=lambda item: -item[1].total)
+        for name, stats in by_total[:top]:
+            lines.append(
+                f"  {name:<48} {stats.count:>7} calls"
+                f" {stats.total * 1000:>10.1f}ms total"
+                f" {stats.total / stats.count * 1000:>8.2f}ms avg"
+                f" {stats.max * 1000:>8.2f}ms max"
+            )
+
+        lines += ["", f"Slowest calls (over {self.slow_call_threshold * 1000:g}ms):"]
+        for call in sorted(self.slow_calls, key=lambda call: -call.duration)[:top]:
+            lines.append(
+                f"  {call.name:<48} {call.duration * 1000:>10.1f}ms"
+                f" at {call.time:%H:%M:%S.%f}"
+            )
+
+        # The innermost frame of each sample is where the time was spent
+        leaves = collections.Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+
+        lines += ["", "Hottest functions (by samples):"]
+        for leaf, count in leaves.most_common(top):
+            lines.append(f"  {count:>7}  {leaf}")
+
+        return "\n".join(lines)
+
+    def write(self, directory: str) -> tuple[str, str]:
+        """Writes the collapsed stacks and the summary to `directory`
+
+        The collapsed stacks can be turned into a flamegraph by tools such
+        as flamegraph.pl or speedscope. Returns the paths of both files.
+        """
+        name = f"profile-{self.started_at:%Y%m%d-%H%M%S}"
+        stacks_path = os.path.join(directory, f"{name}.folded")
+        summary_path = os.path.join(directory, f"{name}.txt")
+
+        with open(stacks_path, "w") as fp:
+            for stack, count in self.stacks.most_common():
+                fp.write(f"{stack} {count}\n")
+
+        with open(summary_path, "w") as fp:
+            fp.write(self.summary())
+            fp.write("\n")
+
+        return stacks_path, summary_path
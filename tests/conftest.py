@@ -0,0 +1,29 @@
+import pytest
+import pytest_asyncio
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine
+
+from observer import config
+from observer.data.repository import StatusLogRepository
+from observer.data.models import metadata
+
+
+@pytest_asyncio.fixture
+@pytest.mark.asyncio
+async def engine():
+    try:
+        engine = create_async_engine(config.TEST_DATABASE_URI)
+
+        # Drop and re-create all the tables before test
+        async with engine.begin() as conn:
+            await conn.run_sync(metadata.drop_all)
+            await conn.run_sync(metadata.create_all)
+
+        yield engine
+
+    finally:
+        await engine.dispose()
+
+
+@pytest.fixture
+def repository(engine: AsyncEngine) -> StatusLogRepository:
+    return StatusLogRepository(engine)
@@ -0,0 +1,174 @@
+import pytest
+import asyncio
+import datetime
+import sqlalchemy as sa
+
+from observer.bot import cogs
+from observer.data.activity import (
+    ActivityRingBuffer,
+    ActivitySample,
+    GuildActivityTracker,
+    fill_gaps,
+)
+from observer.data.models import Status
+from observer.data.repository import StatusLogRepository
+
+
+def _sample(time: datetime.datetime, online: int) -> ActivitySample:
+    return ActivitySample(time=time, online=online, idle=0, dnd=0, offline=0)
+
+
+def test_ring_buffer_overwrites_oldest():
+    """Test that a full buffer drops its oldest samples first"""
+    start = datetime.datetime(year=2023, month=1, day=1, hour=4)
+    buffer = ActivityRingBuffer(capacity=3)
+
+    for minute in range(5):
+        buffer.append(_sample(start + datetime.timedelta(minutes=minute), minute))
+
+    samples = buffer.samples()
+
+    assert len(buffer) == 3
+    assert [sample.online for sample in samples] == [2, 3, 4]
+    assert samples[0].time == start + datetime.timedelta(minutes=2)
+
+
+def test_ring_buffer_one_sample_per_minute():
+    """Test that samples within the same minute replace each other"""
+    start = datetime.datetime(year=2023, month=1, day=1, hour=4)
+    buffer = ActivityRingBuffer(capacity=3)
+
+    buffer.append(_sample(start, 1))
+    buffer.append(_sample(start + datetime.timedelta(seconds=30), 2))
+
+    (sample,) = buffer.samples()
+    assert sample.online == 2
+    assert sample.time == start
+
+
+def test_fill_gaps():
+    """Test that minutes without a sample are left empty"""
+    start = datetime.datetime(year=2023, month=1, day=1, hour=4)
+    samples = [
+        _sample(start + datetime.timedelta(minutes=minute), minute)
+        for minute in (0, 1, 4)
+    ]
+
+    assert fill_gaps(samples) == [samples[0], samples[1], None, None, samples[2]]
+    assert fill_gaps([]) == []
+
+
+def test_tracker_counts_presence_changes():
+    """Test that the counters follow status changes"""
+    now = datetime.datetime(year=2023, month=1, day=1, hour=4)
+    tracker = GuildActivityTracker()
+
+    tracker.reset(1, ["online", "online", "idle", "offline", "invisible"])
+    tracker.record_change(1, "online", "dnd")
+    tracker.record_change(1, "offline", "idle")
+    tracker.sample(now)
+
+    (sample,) = tracker.samples(1)
+    assert sample == ActivitySample(time=now, online=1, idle=2, dnd=1, offline=1)
+
+
+def test_tracker_counts_joins_and_leaves():
+    """Test that members joining and leaving are counted in and out"""
+    now = datetime.datetime(year=2023, month=1, day=1, hour=4)
+    tracker = GuildActivityTracker()
+
+    tracker.reset(1, ["online", "idle"])
+    tracker.record_join(1, "offline")
+    tracker.record_change(1, "offline", "dnd")
+    tracker.record_leave(1, "idle")
+    tracker.sample(now)
+
+    (sample,) = tracker.samples(1)
+    assert sample == ActivitySample(time=now, online=1, idle=0, dnd=1, offline=0)
+
+
+@pytest.mark.asyncio
+async def test_activity_checkpoint(repository: StatusLogRepository):
+    """Test that checkpointed samples can be restored and are written only once"""
+    now = datetime.datetime(year=2023, month=1, day=1, hour=4)
+    tracker = GuildActivityTracker()
+
+    tracker.reset(1, [Status.online, Status.idle])
+    tracker.sample(now)
+    tracker.record_change(1, Status.idle, Status.dnd)
+    tracker.sample(now + datetime.timedelta(minutes=1))
+
+    for guild_id, samples in tracker.pending_checkpoint().items():
+        await repository.log_guild_activity(guild_id, samples)
+        tracker.mark_checkpointed(guild_id, samples[-1].time)
+
+    assert tracker.pending_checkpoint() == {}
+
+    restored = GuildActivityTracker()
+    restored.restore(1, await repository.get_guild_activity(1, since=now))
+
+    assert restored.samples(1) == tracker.samples(1)
+    assert restored.pending_checkpoint() == {}
+
+    # Written again, e.g. by another instance during a rolling restart
+    await repository.log_guild_activity(1, tracker.samples(1))
+    assert await repository.get_guild_activity(1, since=now) == tracker.samples(1)
+
+
+@pytest.mark.asyncio
+async def test_prune_guild_activity(repository: StatusLogRepository):
+    """Test that only the samples older than the cutoff are deleted"""
+    now = datetime.datetime(year=2023, month=1, day=1, hour=4)
+    samples = [_sample(now + datetime.timedelta(minutes=m), m) for m in range(5)]
+
+    await repository.log_guild_activity(1, samples)
+    await repository.log_guild_activity(2, samples[:1])
+    await repository.prune_guild_activity(now + datetime.timedelta(minutes=3))
+
+    assert await repository.get_guild_activity(1, since=now) == samples[3:]
+    assert await repository.get_guild_activity(2, since=now) == []
+
+
+class NoGuildsBot:
+    def get_guild(self, guild_id):
+        return None
+
+
+class FlakyRepository:
+    """Fails its first activity checkpoint write"""
+
+    use_stats_view = False
+
+    def __init__(self):
+        self.writes = []
+
+    async def log_guild_activity(self, guild_id, samples):
+        self.writes.append(samples)
+        if len(self.writes) == 1:
+            raise sa.exc.DBAPIError("INSERT", {}, Exception("connection lost"))
+
+    async def prune_guild_activity(self, older_than):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_activity_checkpoint_survives_errors():
+    """Test that a failed checkpoint is retried instead of stopping the loop"""
+    repo = FlakyRepository()
+    cog = cogs.Status(bot=NoGuildsBot(), repo=repo, guild_ids=[1])
+    cog._activity.reset(1, [Status.online])
+    cog._activity.sample(datetime.datetime.now())
+
+    cog._checkpoint_activity.change_interval(seconds=0.01)
+    cog._checkpoint_activity.start()
+    try:
+        for _ in range(100):
+            if len(repo.writes) >= 2:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        cog._checkpoint_activity.cancel()
+
+    assert len(repo.writes) >= 2
+    assert repo.writes[1] == repo.writes[0]
+    assert cog._activity.pending_checkpoint() == {}
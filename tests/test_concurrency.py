@@ -0,0 +1,86 @@
+import pytest
+import asyncio
+
+from observer.bot.concurrency import KeyedLimiter, QueueFull, SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_result():
+    """Test that concurrent calls with the same key run the computation once"""
+    flight = SingleFlight()
+    calls = []
+
+    async def compute(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        return value
+
+    results = await asyncio.gather(
+        flight.do("a", lambda: compute(1)),
+        flight.do("a", lambda: compute(2)),
+        flight.do("b", lambda: compute(3)),
+    )
+
+    assert results == [1, 1, 3]
+    assert calls == [1, 3]
+    assert not flight.is_in_flight("a")
+
+    # Once done, the next call computes again
+    assert await flight.do("a", lambda: compute(4)) == 4
+
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_exception_and_survives_cancel():
+    """Test that errors reach every caller and one caller cancelling does not
+    cancel the shared computation"""
+    flight = SingleFlight()
+    started = asyncio.Event()
+
+    async def fail():
+        started.set()
+        await asyncio.sleep(0.01)
+        raise ValueError("failed")
+
+    first = asyncio.create_task(flight.do("a", fail))
+    await started.wait()
+    second = asyncio.create_task(flight.do("a", fail))
+    await asyncio.sleep(0)
+
+    first.cancel()
+
+    with pytest.raises(ValueError):
+        await second
+
+
+@pytest.mark.asyncio
+async def test_keyed_limiter_bounds_queue():
+    """Test that callers beyond the concurrency limit queue up to a bound"""
+    limiter = KeyedLimiter(concurrency=1, max_waiting=1)
+    release = asyncio.Event()
+
+    async def hold():
+        async with limiter.acquire("guild"):
+            await release.wait()
+
+    running = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+    waiting = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+
+    assert limiter.metrics["guild"].running == 1
+    assert limiter.metrics["guild"].waiting == 1
+
+    with pytest.raises(QueueFull):
+        async with limiter.acquire("guild"):
+            pass
+
+    # Other keys are limited separately
+    async with limiter.acquire("other"):
+        pass
+
+    release.set()
+    await asyncio.gather(running, waiting)
+
+    metrics = limiter.metrics["guild"]
+    assert (metrics.completed, metrics.rejected, metrics.max_waiting) == (2, 1, 1)
+    assert (metrics.running, metrics.waiting) == (0, 0)
@@ -0,0 +1,104 @@
+import pytest
+import asyncio
+import discord
+import time
+from discord.ext import commands
+
+from observer.bot import cogs
+from observer.profiling import Profiler
+
+
+class Service:
+    async def fast(self):
+        return "fast"
+
+    async def slow(self):
+        await asyncio.sleep(0.02)
+        return "slow"
+
+    async def _private(self):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_profiler_times_calls_and_restores():
+    """Test that instrumented calls are timed and the originals come back on stop"""
+    service = Service()
+    profiler = Profiler(slow_call_threshold=0.01)
+
+    profiler.instrument(service)
+    profiler.start()
+
+    assert await service.fast() == "fast"
+    assert await service.slow() == "slow"
+    await service._private()
+
+    profiler.stop()
+
+    assert set(profiler.calls) == {"Service.fast", "Service.slow"}
+    assert profiler.calls["Service.slow"].count == 1
+    assert profiler.calls["Service.slow"].max >= 0.02
+    assert [call.name for call in profiler.slow_calls] == ["Service.slow"]
+
+    # Nothing is recorded once stopped
+    assert "fast" not in vars(service)
+    await service.fast()
+    assert profiler.calls["Service.fast"].count == 1
+
+
+def test_profiler_refuses_to_instrument_twice():
+    """Test that nested wrappers, which could not be restored, are refused"""
+    service = Service()
+    first, second = Profiler(), Profiler()
+
+    first.instrument(service)
+    with pytest.raises(ValueError):
+        second.instrument(service, ["fast"])
+
+    first.stop()
+    second.instrument(service, ["fast"])
+    second.stop()
+    assert "fast" not in vars(service)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_profiles_restore_listeners(tmp_path):
+    """Test that overlapping profiles leave a single listener per event"""
+    bot = commands.Bot(command_prefix="~", intents=discord.Intents.none())
+    service = Service()
+    await bot.add_cog(cogs.Status(bot=bot, repo=service, guild_ids=[]))
+    profiling = cogs.Profiling(bot=bot, repo=service, output_dir=str(tmp_path))
+
+    before = {event: list(listeners) for event, listeners in bot.extra_events.items()}
+
+    await asyncio.gather(profiling.profile_for(0.01), profiling.profile_for(0.01))
+
+    assert bot.extra_events == before
+    assert len(bot.extra_events["on_presence_update"]) == 1
+    assert "fast" not in vars(service)
+
+
+def test_profiler_samples_stacks(tmp_path):
+    """Test that stacks are sampled and written in collapsed format"""
+    profiler = Profiler(interval=0.001)
+
+    def busy():
+        deadline = time.perf_counter() + 0.05
+        while time.perf_counter() < deadline:
+            pass
+
+    profiler.start()
+    busy()
+    profiler.stop()
+
+    assert any("busy (" in stack for stack in profiler.stacks)
+
+    stacks_path, summary_path = profiler.write(str(tmp_path))
+
+    with open(stacks_path) as fp:
+        stack, count = fp.readline().rsplit(" ", 1)
+        assert stack.startswith("MainThread;")
+        assert int(count) > 0
+
+    with open(summary_path) as fp:
+        assert "Hottest functions" in fp.read()
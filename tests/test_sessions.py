@@ -0,0 +1,111 @@
+import pytest
+import datetime
+import random
+import statistics
+
+from observer.data.models import Status
+from observer.data.repository import StatusLogRepository
+from observer.data.sessions import LogHistogram, SessionStats
+
+
+def test_histogram_quantiles_within_relative_error():
+    """Test that quantiles stay within the configured relative error"""
+    rng = random.Random(0)
+    values = [rng.lognormvariate(6, 2) for _ in range(10000)]
+
+    histogram = LogHistogram(relative_error=0.02)
+    for value in values:
+        histogram.add(value)
+
+    exact = statistics.quantiles(values, n=100, method="inclusive")
+    for q in (50, 90, 99):
+        if exact[q - 1] > histogram.min_value:
+            assert histogram.quantile(q / 100) == pytest.approx(exact[q - 1], rel=0.03)
+
+    assert histogram.quantile(0) == min(values)
+    assert histogram.quantile(1) == max(values)
+    assert LogHistogram().quantile(0.5) is None
+
+
+def test_histogram_merge():
+    """Test that merged histograms match one fed with all the values"""
+    whole, first, second = LogHistogram(), LogHistogram(), LogHistogram()
+
+    for value in range(1, 5000, 7):
+        whole.add(value)
+        (first if value % 2 else second).add(value)
+
+    first.merge(second)
+
+    assert first.count == whole.count
+    assert first.total == whole.total
+    for q in (0.1, 0.5, 0.9, 0.99):
+        assert first.quantile(q) == whole.quantile(q)
+
+    with pytest.raises(ValueError):
+        first.merge(LogHistogram(relative_error=0.1))
+
+
+def test_zero_length_intervals_are_ignored():
+    """Test that intervals between entries logged at once do not count"""
+    now = datetime.datetime(year=2023, month=1, day=1, hour=4)
+    stats = SessionStats()
+
+    stats.add_interval(Status.online, now, now + datetime.timedelta(minutes=5))
+    stats.add_interval(
+        Status.idle,
+        now + datetime.timedelta(minutes=5),
+        now + datetime.timedelta(minutes=5),
+    )
+    stats.add_interval(
+        Status.online,
+        now + datetime.timedelta(minutes=5),
+        now + datetime.timedelta(minutes=9),
+    )
+    stats.finish()
+
+    assert set(stats.histograms) == {Status.online}
+    assert stats.histograms[Status.online].count == 1
+    assert stats.tracked == 9 * 60
+
+
+@pytest.mark.asyncio
+async def test_user_sessions(repository: StatusLogRepository):
+    """Test that intervals are streamed and merged into sessions"""
+    now = datetime.datetime(year=2023, month=1, day=1, hour=4)
+    minutes = datetime.timedelta(minutes=1)
+
+    changes = [
+        (0, None, Status.online),
+        (30, Status.online, Status.online),  # early log, same session
+        (60, Status.online, Status.idle),  # online  60m
+        (70, Status.idle, Status.online),  # idle    10m
+        (90, Status.online, None),  # online  20m, shutdown
+        (120, None, Status.online),  # startup, not a session
+        (125, Status.online, Status.idle),  # online   5m
+        (130, Status.idle, Status.idle),  # early log, same session
+        (135, Status.idle, Status.offline),  # idle    10m
+    ]
+    for offset, before, after in changes:
+        await repository.log_status_change(1, 2, before, after, now + offset * minutes)
+
+    # Another guild should not leak in
+    await repository.log_status_change(1, 3, Status.online, Status.idle, now)
+
+    stats = await repository.get_user_sessions(1, 2)
+
+    assert set(stats.histograms) == {Status.online, Status.idle}
+    assert stats.tracked == (135 - 30) * 60
+
+    online = stats.histograms[Status.online]
+    assert online.count == 3
+    assert (online.min, online.max) == (5 * 60, 60 * 60)
+    assert online.quantile(0.5) == pytest.approx(20 * 60, rel=0.02)
+
+    idle = stats.histograms[Status.idle]
+    assert idle.count == 2
+    assert idle.total == 20 * 60
+
+    days = stats.tracked / (24 * 60 * 60)
+    assert stats.sessions_per_day(Status.online) == pytest.approx(3 / days)
+    assert stats.sessions_per_day(Status.dnd) == 0
@@ -0,0 +1,76 @@
+import pytest
+import asyncio
+import logging
+from collections import namedtuple
+
+from observer.bot import cogs
+
+
+Guild = namedtuple("Guild", ["id", "members"])
+Member = namedtuple("Member", ["id", "guild", "status"])
+Status = namedtuple("Status", ["name"])
+
+
+class FakeBot:
+    def __init__(self, guilds):
+        self.guilds = {guild.id: guild for guild in guilds}
+
+    def get_guild(self, guild_id):
+        return self.guilds.get(guild_id)
+
+    async def fetch_guild(self, guild_id):
+        raise AssertionError("no REST calls on shutdown")
+
+
+class SlowRepository:
+    """Takes `delays[guild_id]` seconds to write the markers of a guild"""
+
+    def __init__(self, delays):
+        self.delays = delays
+        self.changes = []
+        self.markers = {}
+
+    async def log_status_change(self, **change):
+        await asyncio.sleep(0.05)
+        self.changes.append(change)
+
+    async def prune_guild_activity(self, older_than):
+        pass
+
+    async def log_statuses_before_shutdown(self, members, guild_id, shutdown_time):
+        await asyncio.sleep(self.delays[guild_id])
+        self.markers[guild_id] = members
+
+
+@pytest.mark.asyncio
+async def test_shutdown_is_concurrent_and_bounded(caplog):
+    """Test that shutdown markers are written concurrently within the deadline"""
+    guilds = [Guild(id, [Member(id * 10, None, Status("online"))]) for id in (1, 2, 3)]
+    # Written one after the other, the first two guilds would not fit in the
+    # deadline; the third never does.
+    repo = SlowRepository({1: 1, 2: 1, 3: 10})
+    cog = cogs.Status(
+        bot=FakeBot(guilds), repo=repo, guild_ids=[1, 2, 3, 4], shutdown_timeout=1.5
+    )
+    cog._is_ready = True
+
+    # A status change still being written when the bot is asked to stop
+    member = guilds[0].members[0]
+    change = asyncio.create_task(
+        cog.on_presence_update(
+            member._replace(guild=guilds[0]),
+            member._replace(guild=guilds[0], status=Status("idle")),
+        )
+    )
+    await asyncio.sleep(0)
+
+    with caplog.at_level(logging.WARNING):
+        await cog.cog_unload()
+
+    assert change.done()
+    assert len(repo.changes) == 1
+    assert set(repo.markers) == {1, 2}
+
+    messages = "\n".join(record.getMessage() for record in caplog.records)
+    assert "Gave up on writing the shutdown markers of guild 3 (1 members)" in messages
+    assert "Guild 4 is not cached" in messages
@@ -0,0 +1,33 @@
+import pytest
+import pathlib
+import subprocess
+import sys
+
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from observer.data.repository import StatusLogRepository
+
+
+def test_startup_does_not_import_pillow():
+    """Test that Pillow is only imported once the graphs are needed"""
+    # A fresh interpreter, other tests may have imported it already
+    subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, observer.__main__; assert 'PIL' not in sys.modules",
+        ],
+        cwd=pathlib.Path(__file__).parent.parent,
+        check=True,
+    )
+
+
+@pytest.mark.asyncio
+async def test_warm_up_fills_pool(engine: AsyncEngine, repository: StatusLogRepository):
+    """Test that warming up opens all the connections of the pool"""
+    assert engine.pool.checkedin() < engine.pool.size()
+
+    await repository.warm_up()
+
+    assert engine.pool.checkedin() == engine.pool.size()
+    assert "observer.data.imggen.graph" in sys.modules
@@ -0,0 +1,137 @@
+import pytest
+import asyncio
+import pytest_asyncio
+import sqlalchemy as sa
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from sqlalchemy.ext.asyncio import AsyncEngine
+import datetime
+import importlib.util
+import pathlib
+
+from observer.bot import cogs
+from observer.data.repository import StatusLogRepository
+from observer.data.models import Status
+
+
+# The migration creating the view, run as is so that the tests cannot drift
+# from it
+MIGRATION = (
+    pathlib.Path(__file__).parent.parent
+    / "migrations"
+    / "versions"
+    / "a8e4d1c6f2b3_create_statusstats_view.py"
+)
+
+
+def _load_migration():
+    spec = importlib.util.spec_from_file_location(MIGRATION.stem, MIGRATION)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _run_migration(connection, func) -> None:
+    with Operations.context(MigrationContext.configure(connection)):
+        func()
+
+
+@pytest_asyncio.fixture
+async def stats_view(engine: AsyncEngine):
+    """Creates the StatusStats view by running its migration"""
+    migration = _load_migration()
+
+    async with engine.begin() as conn:
+        # The index is part of the models already, but created by the
+        # migration too
+        await conn.execute(sa.text('DROP INDEX "ix_StatusLog_guild_id_user_id_time"'))
+        await conn.run_sync(_run_migration, migration.upgrade)
+
+    yield
+
+    async with engine.begin() as conn:
+        await conn.run_sync(_run_migration, migration.downgrade)
+
+
+def _totals(result) -> dict[Status, float]:
+    return {item.status: item.time.total_seconds() for item in result}
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("stats_view")
+async def test_stats_view_matches_query(engine: AsyncEngine):
+    """Test that stats combining the view with newer entries match the plain query"""
+    plain = StatusLogRepository(engine)
+    viewed = StatusLogRepository(engine, use_stats_view=True)
+
+    assert viewed.use_stats_view
+
+    # Entries on both sides of the watermark, including an interval that
+    # spans across it. The view is refreshed right after the third entry,
+    # which is 15 minutes in the past.
+    now = datetime.datetime.now() - datetime.timedelta(minutes=60)
+    changes = [
+        (None, Status.online, 0),
+        (Status.online, Status.idle, 15),  # online 15m
+        (Status.idle, Status.dnd, 30),  # idle 30m
+        (Status.dnd, Status.online, 60),  # dnd 60m; spans the watermark
+        (Status.online, Status.online, 20),  # online 20m; early log
+        (Status.idle, Status.offline, 5),  # invalid
+        (Status.offline, Status.idle, 7),  # offline 7m
+    ]
+
+    for index, (before, after, minutes) in enumerate(changes):
+        now += datetime.timedelta(minutes=minutes)
+        await plain.log_status_change(1, 2, before, after, now)
+
+        # Entries of another user in the same guild should not leak in
+        await plain.log_status_change(3, 2, before, after, now)
+
+        if index == 2:
+            await viewed.refresh_stats_view()
+
+    expected = _totals(await plain.get_user_stats(1, 2))
+
+    assert expected == {
+        Status.online: datetime.timedelta(minutes=35).total_seconds(),
+        Status.idle: datetime.timedelta(minutes=30).total_seconds(),
+        Status.dnd: datetime.timedelta(minutes=60).total_seconds(),
+        Status.offline: datetime.timedelta(minutes=7).total_seconds(),
+    }
+    assert _totals(await viewed.get_user_stats(1, 2)) == expected
+
+    await viewed.refresh_stats_view()
+    assert _totals(await viewed.get_user_stats(1, 2)) == expected
+
+
+class FlakyRepository:
+    """Fails its first stats view refresh, like on a statement timeout"""
+
+    use_stats_view = True
+
+    def __init__(self):
+        self.refreshes = 0
+
+    async def refresh_stats_view(self):
+        self.refreshes += 1
+        if self.refreshes == 1:
+            raise sa.exc.DBAPIError("REFRESH", {}, Exception("statement timeout"))
+
+
+@pytest.mark.asyncio
+async def test_stats_view_refresh_survives_errors():
+    """Test that a failed refresh does not stop the refresh loop"""
+    repo = FlakyRepository()
+    cog = cogs.Status(bot=None, repo=repo, guild_ids=[])
+
+    cog._refresh_stats_view.change_interval(seconds=0.01)
+    cog._refresh_stats_view.start()
+    try:
+        for _ in range(100):
+            if repo.refreshes >= 3:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        cog._refresh_stats_view.cancel()
+
+    assert repo.refreshes >= 3
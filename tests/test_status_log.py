@@ -1,34 +1,10 @@
 import pytest
-import pytest_asyncio
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine
+from sqlalchemy.ext.asyncio import AsyncEngine
 import datetime
 from collections import namedtuple
 
-from observer import config
 from observer.data.repository import StatusLogRepository
-from observer.data.models import StatusLog, Status, metadata
-
-
-@pytest_asyncio.fixture
-@pytest.mark.asyncio
-async def engine():
-    try:
-        engine = create_async_engine(config.TEST_DATABASE_URI)
-
-        # Drop and re-create all the tables before test
-        async with engine.begin() as conn:
-            await conn.run_sync(metadata.drop_all)
-            await conn.run_sync(metadata.create_all)
-
-        yield engine
-
-    finally:
-        await engine.dispose()
-
-
-@pytest.fixture
-def repository(engine: AsyncEngine) -> StatusLogRepository:
-    return StatusLogRepository(engine)
+from observer.data.models import StatusLog, Status
 
 
 @pytest.mark.asyncio
@@ -61,6 +37,39 @@ async def test_can_insert(repository: StatusLogRepository, engine: AsyncEngine):
     assert obj.time == now
 
 
+@pytest.mark.asyncio
+async def test_raw_inserts_match_core_inserts(engine: AsyncEngine):
+    """Test that the asyncpg fast path inserts the same rows as Core"""
+    if engine.dialect.driver != "asyncpg":
+        pytest.skip("raw inserts are only used with asyncpg")
+
+    now = datetime.datetime(year=2023, month=1, day=1, hour=4, minute=2)
+
+    for use_raw_inserts, user_id in ((True, 1), (False, 2)):
+        repository = StatusLogRepository(engine, use_raw_inserts=use_raw_inserts)
+        assert repository.use_raw_inserts == use_raw_inserts
+
+        # The cog passes status names, the tests pass `Status` members
+        await repository.log_status_change(user_id, 3, None, "online", now)
+        await repository.log_status_change(
+            user_id, 3, Status.online, Status.dnd, now + datetime.timedelta(hours=1)
+        )
+
+    async with engine.connect() as conn:
+        result = await conn.execute(
+            StatusLog.select().order_by(StatusLog.c.user_id, StatusLog.c.time)
+        )
+
+    rows = result.fetchall()
+    assert len(rows) == 4
+
+    # Everything but the user id should be the same
+    assert [row[1:] for row in rows[:2]] == [row[1:] for row in rows[2:]]
+    assert rows[0].after == Status.online
+    assert rows[1].before == Status.online
+    assert rows[1].after == Status.dnd
+
+
 @pytest.mark.asyncio
 async def test_stats(repository: StatusLogRepository):
     """Test that correct stats are produced for basic logs"""
@@ -340,3 +349,61 @@ async def test_stats_with_early_logs(repository: StatusLogRepository):
     assert idle.total_seconds() == datetime.timedelta(minutes=16).total_seconds()
     assert dnd.total_seconds() == datetime.timedelta(minutes=17).total_seconds()
     assert offline.total_seconds() == datetime.timedelta(minutes=3).total_seconds()
+
+
+@pytest.mark.asyncio
+async def test_stats_all_guilds(repository: StatusLogRepository):
+    """Test that stats across guilds do not count the same time twice
+
+    A presence change is seen in every guild the user is in, at slightly
+    different times, and guilds may have started logging at different times.
+    """
+    now = datetime.datetime(
+        year=2023,
+        month=1,
+        day=1,
+        hour=4,
+        minute=2,
+    )
+
+    def at(minutes, seconds=0):
+        return now + datetime.timedelta(minutes=minutes, seconds=seconds)
+
+    # Guild 2
+    await repository.log_status_change(1, 2, None, Status.online, at(0))
+    await repository.log_status_change(1, 2, Status.online, Status.idle, at(10))
+    await repository.log_status_change(1, 2, Status.idle, Status.offline, at(30))
+
+    # Guild 3, logging since a bit later
+    await repository.log_status_change(1, 3, None, Status.online, at(5))
+    await repository.log_status_change(1, 3, Status.online, Status.idle, at(10, 1))
+    await repository.log_status_change(1, 3, Status.idle, Status.offline, at(30))
+    await repository.log_status_change(1, 3, Status.offline, Status.dnd, at(40))
+    await repository.log_status_change(1, 3, Status.dnd, Status.offline, at(50))
+
+    # Another user
+    await repository.log_status_change(4, 2, None, Status.online, at(0))
+    await repository.log_status_change(4, 2, Status.online, Status.idle, at(60))
+
+    result = await repository.get_user_stats_all_guilds(1)
+
+    # Expected stats
+    # online   10m 1s  (0 - 10m 1s)
+    # idle     20m     (10m - 30m)
+    # offline  10m     (30m - 40m, guild 3 only)
+    # dnd      10m     (40m - 50m, guild 3 only)
+
+    assert len(result) == 4
+
+    online = next(item for item in result if item.status == Status.online).time
+    idle = next(item for item in result if item.status == Status.idle).time
+    offline = next(item for item in result if item.status == Status.offline).time
+    dnd = next(item for item in result if item.status == Status.dnd).time
+
+    assert (
+        online.total_seconds()
+        == datetime.timedelta(minutes=10, seconds=1).total_seconds()
+    )
+    assert idle.total_seconds() == datetime.timedelta(minutes=20).total_seconds()
+    assert offline.total_seconds() == datetime.timedelta(minutes=10).total_seconds()
+    assert dnd.total_seconds() == datetime.timedelta(minutes=10).total_seconds()